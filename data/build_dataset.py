@@ -0,0 +1,434 @@
+"""This module builds the images and questions of several tasks in a single process.
+
+Each task is imported only if it is requested, and the questions of each image are created from the
+parameters it was drawn with, so images are not listed and their filenames are not parsed. Images of all
+the tasks are drawn in chunks by a shared pool of worker processes.
+"""
+import argparse
+import importlib
+import itertools
+import os
+import random
+import shlex
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+from common.image_writer import ImageWriter, use_writer
+from common.question_files import write_questions
+from common.render_cache import RenderCache
+
+TASKS = ['cubes', 'figures', 'maze']
+# Modules of the tasks, which have the same names in every task directory
+TASK_MODULES = ['create_images', 'create_questions', 'fast_renderer', 'figure_axes']
+DATA_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Modules and image writer of each task, created once in each process
+MODULES = {}
+WRITERS = {}
+
+
+def task_modules(task):
+    """Import the modules of a task, the first time it is used in this process.
+
+    Modules of different tasks have the same names, so they are removed from sys.modules once imported,
+    and each task keeps its own modules.
+
+    Args:
+        task (str): name of the task.
+
+    Returns:
+        dict: create_images and create_questions modules of the task.
+    """
+    if task not in MODULES:
+        directory = os.path.join(DATA_PATH, task)
+        sys.path.insert(0, directory)
+        try:
+            MODULES[task] = {name: importlib.import_module(name)
+                             for name in ['create_images', 'create_questions']}
+        finally:
+            sys.path.remove(directory)
+            for name in TASK_MODULES:
+                sys.modules.pop(name, None)
+    return MODULES[task]
+
+
+def task_writer(task, args):
+    """Use the image writer of a task, which is created the first time it is used in this process.
+
+    Every task saves its images with the shared 'save_image', so the writer is set before each chunk.
+
+    Args:
+        task (str): name of the task.
+        args: parsed arguments of the task.
+
+    Returns:
+        ImageWriter: image writer of the task.
+    """
+    if task not in WRITERS:
+        cache = None
+        if args.cache_path:
+            cache = RenderCache(args.cache_path, args.cache_size * 2**20)
+        WRITERS[task] = ImageWriter(args.image_format, args.compress_level, args.palette, args.writer_threads,
+                                    cache=cache)
+    use_writer(WRITERS[task])
+    return WRITERS[task]
+
+
+def task_arguments(task, args):
+    """Parse the arguments of a task with the parser of its create_images.py.
+
+    Number of images, output path and seed are the ones of the builder, and its workers draw the images.
+
+    Args:
+        task (str): name of the task.
+        args: parsed arguments of the builder.
+
+    Returns:
+        args: parsed arguments of the task.
+    """
+    create_images = task_modules(task)['create_images']
+    task_args = create_images.parse_arguments(shlex.split(getattr(args, f"{task}_args")))
+    task_args = create_images.check_args(task_args)
+
+    task_args.n = args.n
+    task_args.output_path = os.path.join(args.output_path, task, 'images')
+    task_args.seed = args.seed
+    task_args.skip_render = task_args.skip_render or args.skip_render
+    if args.workers > 1:
+        # Worker processes save their own images
+        task_args.writer_threads = 0
+    return task_args
+
+
+def cubes_scenes(args, chunk_size):
+    """Sample the figures of the cubes task in this process, so that duplicates are rejected in a single place.
+
+    Args:
+        args: parsed arguments of the task.
+        chunk_size (int): number of figures of each chunk.
+
+    Returns:
+        tuple: number of figures, chunks of (heights, shape, colormap, figure_path) tuples and function
+            that reports how many figures were created.
+    """
+    create_images = task_modules('cubes')['create_images']
+    sampler = create_images.FigureEnumerator(args) if args.enumerate else create_images.FigureSampler(args)
+    return sampler.total, sampled_chunks(iter(sampler), chunk_size), sampler.report
+
+
+def sampled_chunks(figures, chunk_size):
+    """Split sampled figures in chunks, sampling them with their own random state.
+
+    Chunks built in this process seed the random generators, so the state of the sampler is kept apart
+    and the figures are the same for any number of workers.
+
+    Args:
+        figures (iterator): sampled figures.
+        chunk_size (int): number of figures of each chunk.
+
+    Yields:
+        list: figures of each chunk.
+    """
+    state = random.getstate(), np.random.get_state()
+    while True:
+        random.setstate(state[0])
+        np.random.set_state(state[1])
+        chunk = list(itertools.islice(figures, chunk_size))
+        state = random.getstate(), np.random.get_state()
+        if not chunk:
+            return
+        yield chunk
+
+
+def index_scenes(args, chunk_size):
+    """Split the images of the figures and maze tasks in chunks of indices, which are drawn by the workers.
+
+    Args:
+        args: parsed arguments of the task.
+        chunk_size (int): number of images of each chunk.
+
+    Returns:
+        tuple: number of images, chunks of indices and None, as there is nothing to report.
+    """
+    chunks = [range(start, min(start + chunk_size, args.n)) for start in range(0, args.n, chunk_size)]
+    return args.n, chunks, None
+
+
+def build_cubes(args, figures):
+    """Draw a chunk of figures of the cubes task, unless skip_render, and create their questions.
+
+    Args:
+        args: parsed arguments of the task.
+        figures (list): (heights, shape, colormap, figure_path) tuples.
+
+    Returns:
+        tuple: manifest lines and questions of the figures.
+    """
+    modules = task_modules('cubes')
+    create_images, create_questions = modules['create_images'], modules['create_questions']
+
+    entries = []
+    for figure in figures:
+        if not args.skip_render:
+            create_images.draw_figure_task(args.renderer, figure)
+        entries.append(create_images.manifest_entry(*figure))
+
+    figures = [(os.path.basename(path), heights, shape) for heights, shape, _, path in figures]
+    questions = []
+    for (file, _, shape), count in zip(figures, create_questions.count_figures(figures)):
+        questions.extend(create_questions.figure_questions(file, shape, count))
+    return entries, questions
+
+
+def build_figures(args, indices):
+    """Draw a chunk of images of the figures task, unless skip_render, and create their questions.
+
+    Args:
+        args: parsed arguments of the task.
+        indices (range): indices of the images.
+
+    Returns:
+        tuple: manifest lines and questions of the images.
+    """
+    modules = task_modules('figures')
+    create_images, create_questions = modules['create_images'], modules['create_questions']
+
+    entries, images = [], []
+    for figure_matrix in create_images.random_figures_batch(args.x_len, args.y_len, len(indices)):
+        fig_name, _ = create_images.create_image(args.output_path, args.x_len, args.y_len, args.r,
+                                                 args.renderer, figure_matrix, not args.skip_render)
+        entries.append(create_images.manifest_entry(fig_name, figure_matrix, args.x_len, args.y_len))
+        images.append((fig_name, figure_matrix, args.x_len, args.y_len))
+
+    return entries, list(zip(*create_questions.question_table(images).values()))
+
+
+def build_maze(args, indices):
+    """Create a chunk of mazes, draw them unless skip_render, and create their questions.
+
+    Args:
+        args: parsed arguments of the task.
+        indices (range): indices of the mazes.
+
+    Returns:
+        tuple: manifest lines and questions of the mazes.
+    """
+    modules = task_modules('maze')
+    create_images, create_questions = modules['create_images'], modules['create_questions']
+
+    entries, mazes = [], []
+    for i in indices:
+        image, end, walls = create_images.create_image_task(args, i)
+        entries.append(create_images.manifest_entry(image, args.nx, args.ny, args.start, end, walls))
+        mazes.append((image, args.nx, args.ny, args.start, end, walls))
+
+    questions = []
+    for (image, nx, ny, _, end, _), solution in zip(mazes, create_questions.solve_chunk(mazes)):
+        questions.extend(create_questions.maze_questions(image, nx, ny, end, solution))
+    return entries, questions
+
+
+# Function that splits the images of each task in chunks, and function that builds each chunk
+SCENES = {'cubes': cubes_scenes, 'figures': index_scenes, 'maze': index_scenes}
+BUILDERS = {'cubes': build_cubes, 'figures': build_figures, 'maze': build_maze}
+
+
+def build_chunk(job):
+    """Build a chunk of images of a task, in this process or in a worker process.
+
+    The random generators are seeded from the seed, the task and the index of the chunk, so the images
+    and questions are the same for any number of workers.
+
+    Args:
+        job (tuple): name of the task, parsed arguments of the task, index of the chunk and scenes of the
+            chunk.
+
+    Returns:
+        tuple: name of the task, manifest lines and questions of the chunk.
+    """
+    task, args, index, scenes = job
+    task_writer(task, args)
+    random.seed(f"{args.seed}_{task}_{index}")
+    np.random.seed(random.randrange(2**32))
+    return (task, *BUILDERS[task](args, scenes))
+
+
+def write_task(task, results, args, task_args, total):
+    """Append the manifest lines of the chunks of a task as they are built, and write their questions.
+
+    Args:
+        task (str): name of the task.
+        results (iterable): chunks of the task built by 'build_chunk'.
+        args: parsed arguments of the builder.
+        task_args: parsed arguments of the task.
+        total (int): number of images of the task.
+    """
+    create_questions = task_modules(task)['create_questions']
+    filename = os.path.join(args.output_path, task, args.filename)
+
+    with open(os.path.join(task_args.output_path, task_args.manifest), 'a', encoding='UTF-8') as manifest, \
+            tqdm(total=total, desc=task.capitalize()) as progress:
+        def questions():
+            for _, entries, chunk_questions in results:
+                manifest.writelines(entries)
+                progress.update(len(entries))
+                yield from chunk_questions
+
+        # Answers that are not numbers, like the exit colors of the maze task, are saved as integers in Parquet
+        answer_codes = getattr(create_questions, 'ANSWER_CODES', None)
+        write_questions(questions(), filename, args.format, answer_codes)
+        # Images saved by the threads of the writer are finished before the manifest is closed
+        if task in WRITERS:
+            WRITERS[task].close()
+
+
+def write_tasks(results, args, task_args, scenes):
+    """Write the chunks of each task as they are built, and report how many images were created.
+
+    Reports are printed once every task is built, as the first chunk of the next task may be built before
+    the previous task is written.
+
+    Args:
+        results (iterable): chunks built by 'build_chunk', task after task.
+        args: parsed arguments of the builder.
+        task_args (dict): parsed arguments of each task.
+        scenes (dict): number of images, chunks and report function of each task.
+    """
+    for task, task_results in itertools.groupby(results, key=lambda result: result[0]):
+        write_task(task, task_results, args, task_args[task], scenes[task][0])
+
+    for task in args.tasks:
+        report = scenes[task][2]
+        if report is not None:
+            report()
+        if WRITERS[task].cache is not None:
+            task_modules(task)['create_images'].report_cache(WRITERS[task].cache)
+
+
+def parse_arguments():
+    """Parse command line arguments.
+
+    Returns:
+        args: parsed arguments.
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--tasks",
+        type=str,
+        nargs='+',
+        default=TASKS,
+        choices=TASKS,
+        help="Tasks to build. Modules of the other tasks are not imported.",
+    )
+
+    parser.add_argument(
+        "--n",
+        type=int,
+        default=100,
+        help="Number of images created for each task.",
+    )
+
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default='.',
+        help="Path with a directory for each task. Images and the manifest are saved to the images directory "
+             "of each task, and questions to filename.",
+    )
+
+    parser.add_argument(
+        "--filename",
+        type=str,
+        default='questions.csv',
+        help="Name of the questions file of each task. Compressed with gzip if it ends with .gz.",
+    )
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        default='csv',
+        choices=['csv', 'parquet'],
+        help="Format of the questions files. 'parquet' needs pyarrow.",
+    )
+
+    parser.add_argument(
+        "--skip_render",
+        action='store_true',
+        help="Only create the scenes, their manifest and their questions, without drawing the images. "
+             "Images can be drawn later with the render_manifest argument of each create_images.py.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes shared by all the tasks to draw the images.",
+    )
+
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=64,
+        help="Number of images drawn by a worker at once.",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed. The same seed creates the same dataset for any number of workers.",
+    )
+
+    for task in TASKS:
+        parser.add_argument(
+            f"--{task}_args",
+            type=str,
+            default='',
+            help=f"Arguments of data/{task}/create_images.py, like \"--renderer fast\". Number of images, "
+                 "output path, seed and workers are the ones of the builder.",
+        )
+
+    args = parser.parse_args()
+    if args.workers < 1:
+        args.workers = 1
+        print("WARNING: At least one worker is needed! Lower values have been set to 1.")
+    if args.chunk_size < 1:
+        args.chunk_size = 1
+        print("WARNING: Chunks need at least one image! Lower values have been set to 1.")
+
+    return args
+
+
+def main():
+    """Main function."""
+    args = parse_arguments()
+    if args.seed is None:
+        # Chunks are seeded from the seed, so that each one has a different random state
+        args.seed = random.randrange(2**32)
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    # Tasks are imported before the workers are started, so that forked workers do not import them again
+    task_args = {task: task_arguments(task, args) for task in args.tasks}
+    for task in args.tasks:
+        os.makedirs(task_args[task].output_path, exist_ok=True)
+        task_writer(task, task_args[task])
+
+    scenes = {task: SCENES[task](task_args[task], args.chunk_size) for task in args.tasks}
+    # Chunks are built task after task, but the workers start with the next task as soon as they are free
+    jobs = ((task, task_args[task], index, chunk)
+            for task in args.tasks for index, chunk in enumerate(scenes[task][1]))
+
+    if args.workers == 1:
+        write_tasks(map(build_chunk, jobs), args, task_args, scenes)
+    else:
+        with Pool(args.workers) as pool:
+            write_tasks(pool.imap(build_chunk, jobs), args, task_args, scenes)
+
+
+if __name__ == '__main__':
+    main()
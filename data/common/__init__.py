@@ -0,0 +1 @@
+"""This package contains the modules shared by every task, like saving and caching images."""
@@ -0,0 +1,53 @@
+"""This module contains the functions shared by the datasets of every task and by the evaluation of their images."""
+import contextlib
+import random
+
+import numpy as np
+from PIL import Image
+
+
+@contextlib.contextmanager
+def kept_random_state():
+    """Restore the state of random and np.random after drawing an item, which seeds them.
+
+    The random numbers of the caller, like the shuffling or augmentation of a training loop, do not depend
+    on the items it reads.
+    """
+    state = random.getstate(), np.random.get_state()
+    try:
+        yield
+    finally:
+        random.setstate(state[0])
+        np.random.set_state(state[1])
+
+
+def rgb_image(image, white_background=False):
+    """Convert an image to RGB, like the notebook does, or over a white background where it is transparent.
+
+    Maze images have a transparent background, which is black like the walls when the image is only
+    converted to RGB. The results of the notebook were computed that way.
+
+    Args:
+        image (Image): image to convert.
+        white_background (bool): draw transparent images over a white background.
+
+    Returns:
+        Image: RGB image.
+    """
+    if not white_background:
+        return image.convert('RGB')
+    background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+    return Image.alpha_composite(background, image.convert('RGBA')).convert('RGB')
+
+
+def to_rgb(image, white_background=False):
+    """Convert an image to an RGB array, like 'rgb_image'.
+
+    Args:
+        image (Image): image to convert.
+        white_background (bool): draw transparent images over a white background.
+
+    Returns:
+        numpy.ndarray: [height, width, 3] uint8 array.
+    """
+    return np.asarray(rgb_image(image, white_background))
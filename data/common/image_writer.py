@@ -0,0 +1,287 @@
+"""This module saves images in background threads, so that encoding overlaps with drawing the next image."""
+import contextlib
+import os
+import queue
+import threading
+from functools import partial
+
+import numpy as np
+from PIL import Image
+
+from common.render_cache import scene_key, temporary_path
+
+# File extension of each image format
+IMAGE_FORMATS = {'png': '.png', 'webp': '.webp'}
+
+
+def to_palette(image):
+    """Convert an image to palette mode if it has at most 256 colors, so that no color is lost.
+
+    Palette PNG files are smaller and much faster to encode than RGB or RGBA ones.
+
+    Args:
+        image (Image): RGB or RGBA image.
+
+    Returns:
+        Image: palette image, or the same image if it has more than 256 colors.
+    """
+    if image.mode not in ('RGB', 'RGBA') or image.getcolors(256) is None:
+        return image
+
+    rgba = image.convert('RGBA') if image.mode == 'RGB' else image
+    # Each RGBA pixel is read as a 32-bit integer, and replaced by its index in the sorted colors
+    colors = np.array([color for _, color in rgba.getcolors(256)], dtype=np.uint8)
+    codes = np.sort(colors.view(np.uint32).ravel())
+    indices = np.searchsorted(codes, np.asarray(rgba).view(np.uint32)[..., 0]).astype(np.uint8)
+
+    palette = codes.view(np.uint8).reshape(-1, 4)
+    indexed = Image.fromarray(indices, 'P')
+    indexed.putpalette(palette[:, :3].tobytes())
+    if (palette[:, 3] < 255).any():
+        indexed.info['transparency'] = palette[:, 3].tobytes()
+    return indexed
+
+
+class ImageWriter:
+    """Save images with the given format and options, in background threads if threads > 0.
+
+    Images wait in a queue of queue_size images, so drawing blocks when encoding is slower than it.
+    Errors of the background threads are raised by the next 'save' or by 'close'.
+
+    """
+
+    def __init__(self, image_format='png', compress_level=6, palette=False, threads=0, queue_size=32, cache=None):
+        """Create the writer. Its threads are started with the first image.
+
+        Args:
+            image_format (str): 'png' or 'webp', which is lossless.
+            compress_level (int): zlib compression level of PNG files, between 0 and 9.
+            palette (bool): save PNG images with at most 256 colors in palette mode.
+            threads (int): number of background threads. Images are saved by 'save' if 0.
+            queue_size (int): maximum number of images waiting to be saved.
+            cache (RenderCache): cache of rendered images used by 'fetch', or None.
+        """
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.palette = palette
+        self.threads = threads
+        self.queue_size = queue_size
+        self.cache = cache
+        # Cache keys of the images that 'fetch' did not find, by path
+        self.keys = {}
+        self.queue = None
+        self.workers = []
+        self.errors = []
+
+    @property
+    def extension(self):
+        """File extension of the images."""
+
+        return IMAGE_FORMATS[self.image_format]
+
+    def path(self, filename):
+        """Replace the extension of a filename by the extension of the image format.
+
+        Args:
+            filename (str): path of an image.
+
+        Returns:
+            str: path with the extension of the image format.
+        """
+        return os.path.splitext(filename)[0] + self.extension
+
+    def synchronous(self):
+        """Create a writer with the same options and no threads, for worker processes.
+
+        Returns:
+            ImageWriter: image writer.
+        """
+        return ImageWriter(self.image_format, self.compress_level, self.palette, cache=self.cache)
+
+    def fetch(self, filename, key):
+        """Link the image of a scene from the cache to filename.
+
+        If it is not cached, the next image saved to filename is stored in the cache.
+
+        Args:
+            filename (str): path of the image.
+            key (str): key of the scene, from 'scene_key'. Options of the writer are added to it.
+
+        Returns:
+            bool: whether the image was cached, so that it does not need to be rendered.
+        """
+        if self.cache is None:
+            return False
+        key = scene_key(key, self.image_format, self.compress_level, self.palette)
+        path = self.path(filename)
+        if self.cache.fetch(key, self.extension, path):
+            return True
+        self.keys[path] = key
+        return False
+
+    def write(self, image, path):
+        """Save an image to a path in the image format.
+
+        Args:
+            image (Image): image to save.
+            path (str): path of the file.
+        """
+        if self.image_format == 'webp':
+            image.save(path, 'WEBP', lossless=True)
+        else:
+            if self.palette:
+                image = to_palette(image)
+            image.save(path, 'PNG', compress_level=self.compress_level)
+
+    def encode(self, image, filename):
+        """Save an image in the calling thread, and store it in the cache if 'fetch' did not find it.
+
+        Images replace filename at once, so an existing image linked to the cache is never written through.
+
+        Args:
+            image (Image): image to save.
+            filename (str): path of the image. Its extension is replaced by the one of the image format.
+        """
+        path = self.path(filename)
+        key = self.keys.pop(path, None)
+        if key is not None:
+            self.cache.store(key, self.extension, path, partial(self.write, image))
+        else:
+            temporary = temporary_path(path)
+            self.write(image, temporary)
+            os.replace(temporary, path)
+
+    def work(self):
+        """Save the images of the queue until it gets None."""
+
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            try:
+                self.encode(*task)
+            except Exception as error:  # pylint: disable=broad-except
+                self.errors.append(error)
+
+    def save(self, image, filename):
+        """Save an image, or put it in the queue of the background threads.
+
+        The image must not be modified afterwards.
+
+        Args:
+            image (Image): image to save.
+            filename (str): path of the image.
+        """
+        if self.errors:
+            raise self.errors[0]
+        if not self.threads:
+            self.encode(image, filename)
+            return
+
+        if self.queue is None:
+            self.queue = queue.Queue(self.queue_size)
+            self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(self.threads)]
+            for worker in self.workers:
+                worker.start()
+        self.queue.put((image, filename))
+
+    def close(self):
+        """Wait until all the images are saved and stop the threads."""
+
+        if self.queue is not None:
+            for _ in self.workers:
+                self.queue.put(None)
+            for worker in self.workers:
+                worker.join()
+            self.queue = None
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MemoryWriter(ImageWriter):
+    """Keep the saved images in a dictionary by filename, instead of saving them."""
+
+    def __init__(self):
+        """Create the writer with no images."""
+        super().__init__()
+        self.images = {}
+
+    def encode(self, image, filename):
+        """Keep an image instead of saving it.
+
+        Args:
+            image (Image): image to keep.
+            filename (str): path it would be saved to.
+        """
+        self.images[filename] = image
+
+
+# Writer used by 'save_image', replaced with 'use_writer' by the main function and in worker processes
+WRITER = ImageWriter()
+
+
+def use_writer(writer):
+    """Set the writer used by 'save_image'.
+
+    Args:
+        writer (ImageWriter): image writer.
+    """
+    global WRITER  # pylint: disable=global-statement
+    WRITER = writer
+
+
+def save_image(image, filename):
+    """Save an image with the current writer.
+
+    Args:
+        image (Image): image to save.
+        filename (str): path of the image.
+    """
+    WRITER.save(image, filename)
+
+
+def fetch_image(filename, key):
+    """Link the image of a scene from the cache of the current writer, if it is there.
+
+    Args:
+        filename (str): path of the image.
+        key (str): key of the scene, from 'scene_key'.
+
+    Returns:
+        bool: whether the image was cached, so that it does not need to be rendered.
+    """
+    return WRITER.fetch(filename, key)
+
+
+def image_path(filename):
+    """Replace the extension of a filename by the extension of the current writer.
+
+    Args:
+        filename (str): path of an image.
+
+    Returns:
+        str: path with the extension of the image format.
+    """
+    return WRITER.path(filename)
+
+
+@contextlib.contextmanager
+def capture_images():
+    """Keep the images saved with 'save_image' in memory while in the context, instead of saving them.
+
+    Yields:
+        dict: images saved in the context, by filename.
+    """
+    writer = MemoryWriter()
+    previous = WRITER
+    use_writer(writer)
+    try:
+        yield writer.images
+    finally:
+        use_writer(previous)
@@ -0,0 +1,91 @@
+"""This module reads the manifests of the images and writes their questions, in the same way for every task."""
+import csv
+import gzip
+import itertools
+import json
+
+# Columns of the questions files
+QUESTION_COLUMNS = ['type', 'question', 'correct', 'wrong1', 'wrong2', 'image']
+
+
+def manifest_entries(filename):
+    """Read the entries of a manifest, keeping only the last entry of each image.
+
+    The manifest is only appended to, so running create_images.py again in the same output path leaves
+    the entries of the images it overwrites, which no longer describe them. Only the line number of the
+    last entry of each image is kept in memory, and entries are read one line at a time in a second pass.
+
+    Args:
+        filename (str): path to the manifest.
+
+    Yields:
+        dict: entry of each image, in the order of their last lines.
+    """
+    with open(filename, encoding='UTF-8') as manifest:
+        last = {}
+        for number, line in enumerate(manifest):
+            if line.strip():
+                last[json.loads(line)['image']] = number
+        kept = set(last.values())
+        del last
+
+        manifest.seek(0)
+        for number, line in enumerate(manifest):
+            if number in kept:
+                yield json.loads(line)
+
+
+def write_parquet(questions, filename, batch_size=100000, answer_codes=None):
+    """Write questions to a Parquet file as they are created, in batches of batch_size questions.
+
+    Type, question and image columns are dictionary encoded, answers are integers.
+
+    Args:
+        questions (iterable): questions to write.
+        filename (str): path to the output file.
+        batch_size (int): number of questions written at once.
+        answer_codes (dict): integer saved for each answer that is not a number, or None if all of them are.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema([('type', category), ('question', category), ('correct', pa.int64()),
+                        ('wrong1', pa.int64()), ('wrong2', pa.int64()), ('image', category)])
+
+    questions = iter(questions)
+    with pq.ParquetWriter(filename, schema) as writer:
+        while True:
+            batch = list(itertools.islice(questions, batch_size))
+            if not batch:
+                break
+            columns = dict(zip(schema.names, zip(*batch)))
+            if answer_codes:
+                for answer in ['correct', 'wrong1', 'wrong2']:
+                    columns[answer] = [answer_codes.get(value, value) for value in columns[answer]]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+
+def write_questions(questions, filename, file_format='csv', answer_codes=None):
+    """Write questions to a csv or Parquet file as they are created.
+
+    Args:
+        questions (iterable): questions to write.
+        filename (str): path to the output file. Compressed with gzip if it ends with '.gz'.
+        file_format (str): 'csv' or 'parquet'.
+        answer_codes (dict): integer saved in Parquet files for each answer that is not a number, or None.
+            Csv files keep the answers as they are.
+    """
+    if file_format == 'parquet':
+        write_parquet(questions, filename, answer_codes=answer_codes)
+        return
+
+    if filename.endswith('.gz'):
+        csvfile = gzip.open(filename, 'wt', encoding='UTF-8', newline="")
+    else:
+        csvfile = open(filename, 'w', encoding='UTF-8', newline="", buffering=2 ** 20)
+
+    with csvfile:
+        writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(QUESTION_COLUMNS)
+        writer.writerows(questions)
@@ -0,0 +1,158 @@
+"""This module keeps rendered images in a directory, so that scenes rendered before are linked, not drawn again."""
+import hashlib
+import os
+import shutil
+import threading
+
+import numpy as np
+
+# Changing it invalidates the images cached by previous versions of the renderers
+CACHE_VERSION = 1
+
+
+def scene_key(*parts):
+    """Hash the parameters of a scene and its renderer.
+
+    Arrays are hashed by their shape and integer values, so matrices with the same values have the
+    same key whatever their type.
+
+    Args:
+        *parts: strings, numbers, tuples or integer arrays that define the image.
+
+    Returns:
+        str: hexadecimal SHA-256 hash.
+    """
+    digest = hashlib.sha256(f"{CACHE_VERSION}".encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(f"|array{part.shape}|".encode())
+            digest.update(np.ascontiguousarray(part, dtype=np.int64).tobytes())
+        else:
+            digest.update(f"|{part!r}|".encode())
+    return digest.hexdigest()
+
+
+def temporary_path(path):
+    """Name a temporary file next to a path, unique for each process and thread.
+
+    Args:
+        path (str): path of the file.
+
+    Returns:
+        str: path of the temporary file.
+    """
+    return f"{path}.{os.getpid()}_{threading.get_ident()}.tmp"
+
+
+def link(source, target):
+    """Hard link a file to target, or copy it if it cannot be linked, like across file systems.
+
+    Target is replaced at once, so an existing file is never written through, as it may be linked to
+    the cache.
+
+    Args:
+        source (str): path of the file.
+        target (str): path of the link.
+    """
+    # Renaming a link over another link of the same file does nothing, and would leave the temporary one
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return
+    temporary = temporary_path(target)
+    try:
+        os.link(source, temporary)
+    except OSError:
+        shutil.copyfile(source, temporary)
+    os.replace(temporary, target)
+
+
+class RenderCache:
+    """Directory of rendered images, named by the key of their scene.
+
+    Images are found by their name, so worker processes share the cache without any index. Each
+    image is touched when it is used, and 'trim' removes the least recently used ones.
+
+    """
+
+    def __init__(self, path, max_size):
+        """Create the cache directory if it does not exist.
+
+        Args:
+            path (str): directory of the cache.
+            max_size (int): maximum size of the cache in bytes, kept by 'trim'.
+        """
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+    def entry(self, key, extension):
+        """Path of the cached image of a key, in a subdirectory named by its first two characters.
+
+        Args:
+            key (str): key of the scene.
+            extension (str): extension of the image format.
+
+        Returns:
+            str: path of the image in the cache.
+        """
+        return os.path.join(self.path, key[:2], key + extension)
+
+    def fetch(self, key, extension, filename):
+        """Link the cached image of a key to filename, if there is one.
+
+        Args:
+            key (str): key of the scene.
+            extension (str): extension of the image format.
+            filename (str): path of the image.
+
+        Returns:
+            bool: whether the image was cached.
+        """
+        entry = self.entry(key, extension)
+        try:
+            link(entry, filename)
+            # Touched images are the most recently used ones
+            os.utime(entry)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key, extension, filename, save):
+        """Save an image to the cache and link it to filename.
+
+        Args:
+            key (str): key of the scene.
+            extension (str): extension of the image format.
+            filename (str): path of the image.
+            save (callable): function that saves the image to the path it is given.
+        """
+        entry = self.entry(key, extension)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        temporary = temporary_path(entry)
+        save(temporary)
+        os.replace(temporary, entry)
+        link(entry, filename)
+
+    def trim(self):
+        """Remove the least recently used images until the cache is not larger than max_size.
+
+        Returns:
+            tuple: number of images kept, their size in bytes and number of images removed.
+        """
+        images = []
+        for directory in os.scandir(self.path):
+            if directory.is_dir():
+                for image in os.scandir(directory.path):
+                    if not image.name.endswith('.tmp'):
+                        stat = image.stat()
+                        images.append((stat.st_mtime, stat.st_size, image.path))
+
+        images.sort()
+        size = sum(image_size for _, image_size, _ in images)
+        removed = 0
+        for _, image_size, path in images:
+            if size <= self.max_size:
+                break
+            os.remove(path)
+            size -= image_size
+            removed += 1
+        return len(images) - removed, size, removed
@@ -0,0 +1,125 @@
+"""This module compares the speed and the output of the cube renderers against matplotlib."""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from create_images import RENDERERS, random_colormap, random_heights
+from fast_renderer import axes_background, render_figure
+
+
+def pixel_diff(path_a, path_b):
+    """
+    Compares two figures pixel by pixel
+    :param path_a: path of the first image
+    :param path_b: path of the second image, of the same size
+    :return: mean absolute difference (0-255) and fraction of pixels that differ by more than 64
+    """
+    image_a = np.asarray(Image.open(path_a).convert('RGB'), dtype=int)
+    image_b = np.asarray(Image.open(path_b).convert('RGB'), dtype=int)
+    diff = np.abs(image_a - image_b)
+    return diff.mean(), (diff.max(axis=2) > 64).mean()
+
+
+def parse_arguments():
+    """
+    Parse input values
+    :return: input values
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--x_len",
+        type=int,
+        default=4,
+        help="Number of cubes in axis X.",
+    )
+
+    parser.add_argument(
+        "--y_len",
+        type=int,
+        default=4,
+        help="Number of cubes in axis Y.",
+    )
+
+    parser.add_argument(
+        "--z_len",
+        type=int,
+        default=3,
+        help="Number of cubes in axis Z.",
+    )
+
+    parser.add_argument(
+        "--n",
+        type=int,
+        default=20,
+        help="Number of compared pictures.",
+    )
+
+    parser.add_argument(
+        "--prob",
+        type=float,
+        default=0.75,
+        help="Probability to stack a cube on top of another. Value between 0 and 1 (not inclusive).",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed.",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    args = parse_arguments()
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    shape = (args.x_len, args.y_len, args.z_len)
+
+    times = {name: 0.0 for name in RENDERERS}
+    # PNG encoding takes a good part of the fast renderer time, so rendering alone is also measured
+    render_time = 0.0
+    diffs = {name: [] for name in RENDERERS if name != 'matplotlib'}
+    # The fast renderer draws the axes of each shape with matplotlib once, which is measured apart
+    start = time.perf_counter()
+    axes_background(shape)
+    background_time = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in tqdm(range(args.n), total=args.n, desc="Images"):
+            heights = random_heights(args)
+            colormap = random_colormap('random')
+            paths = {name: os.path.join(tmp, f"{name}_{i}.png") for name in times}
+
+            start = time.perf_counter()
+            render_figure(heights, shape, colormap)
+            render_time += time.perf_counter() - start
+
+            for name, draw in RENDERERS.items():
+                start = time.perf_counter()
+                draw(heights, shape, colormap, paths[name])
+                times[name] += time.perf_counter() - start
+
+            for name, diff in diffs.items():
+                diff.append(pixel_diff(paths['matplotlib'], paths[name]))
+
+    print(f"fast axes of the shape: {1000 * background_time:.1f} ms once")
+    for name, total in times.items():
+        print(f"{name}: {1000 * total / args.n:.1f} ms per image, {times['matplotlib'] / total:.1f}x")
+    print(f"fast without writing the PNG: {1000 * render_time / args.n:.1f} ms per image, "
+          f"{times['matplotlib'] / render_time:.1f}x")
+    for name, diff in diffs.items():
+        diff = np.array(diff)
+        print(f"{name}: mean absolute pixel difference {diff[:, 0].mean():.2f} / 255, "
+              f"{100 * diff[:, 1].mean():.2f}% of pixels differ by more than 64")
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,37 @@
 """This module contains the functions that create cube figures."""
 import argparse
+import io
+import itertools
+import json
+import math
 import os
 import random
+import sys
+from fractions import Fraction
+from functools import partial
+from multiprocessing import Pool
 
 import matplotlib.cm as cm
 import matplotlib.pyplot as plt
 import numpy as np
+from PIL import Image
 from tqdm import tqdm
 
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.image_writer import IMAGE_FORMATS, ImageWriter, fetch_image, image_path, save_image, use_writer
+from common.question_files import manifest_entries
+from common.render_cache import RenderCache, scene_key
+from create_questions import parse_filename
+from fast_renderer import draw_figure_fast
+from figure_axes import create_axes
+
+# Shapes with more possible rows are not enumerated, as the table of rows behind each row would be too large
+MAX_ENUMERATED_ROWS = 2048
+
 
 def neighbors_in_front(x, y, heights, shape):
     """
@@ -67,6 +91,153 @@ def sort_by_heights(heights, shape):
     return new_heights
 
 
+def sort_by_heights_batch(heights, shape):
+    """
+    Sorts randomly columns by height for a batch of heights matrices, like 'sort_by_heights' does for one
+    Positions are filled one step at a time for the whole batch, each picked at random among the empty ones
+    whose neighbors behind are already filled, which are the ones 'neighbors_in_front' would add
+    :param heights: [batch_size, x_len, y_len] array, each value specifying the number of cubes in a column
+    :param shape:  (x_len, y_len, z_len) tuple
+    :return: [batch_size, x_len, y_len] array of sorted heights matrices
+    """
+    x_len, y_len, _ = shape
+    batch_size = len(heights)
+
+    # Heights of each matrix from the highest to the lowest, in the order they are placed
+    # The batch is kept in the last axis, so that every operation works on contiguous rows
+    values = -np.sort(-heights.reshape(batch_size, -1), axis=1).T
+    new_heights = np.zeros((x_len * y_len, batch_size), dtype=int)
+    # Positions already filled, with an extra filled row and column behind the matrix
+    filled = np.zeros((x_len + 1, y_len + 1, batch_size), dtype=bool)
+    filled[x_len, :] = True
+    filled[:, y_len] = True
+    columns = np.arange(batch_size)
+    rank_type = np.min_scalar_type(x_len * y_len)
+
+    for value in values:
+        if not value.any():
+            break
+
+        # Empty positions whose neighbors behind are filled, the ones 'neighbors_in_front' would add
+        frontier = ~filled[:-1, :-1] & filled[1:, :-1] & filled[:-1, 1:]
+        frontier = frontier.reshape(x_len * y_len, batch_size)
+        # Pick uniformly the r-th position of the frontier
+        ranks = frontier.cumsum(axis=0, dtype=rank_type)
+        r = (np.random.rand(batch_size) * ranks[-1]).astype(rank_type)
+        position = (ranks <= r).sum(axis=0)
+
+        # Matrices with no heights left keep their position empty
+        new_heights[position, columns] = value
+        x, y = np.divmod(position, y_len)
+        filled[x, y, columns] = value > 0
+
+    return new_heights.T.reshape(batch_size, x_len, y_len)
+
+
+def count_heights(shape):
+    """
+    Counts every possible sorted heights matrix, including the one with no cubes
+    Sorted matrices are plane partitions that fit in the shape, counted with MacMahon's formula
+    :param shape: (x_len, y_len, z_len) tuple
+    :return: number of sorted heights matrices
+    """
+    x_len, y_len, z_len = shape
+    count = Fraction(1)
+    for i in range(1, x_len + 1):
+        for j in range(1, y_len + 1):
+            for k in range(1, z_len + 1):
+                count *= Fraction(i + j + k - 1, i + j + k - 2)
+    return int(count)
+
+
+class HeightsIndex:
+    """Positions of the sorted heights matrices of a shape, in the order 'enumerate_heights' lists them.
+
+    Matrices are lists of rows, each behind the previous one, so the number of matrices that follow each row
+    is counted once, and the matrix at any position is found row by row without listing the ones before it.
+
+    """
+
+    def __init__(self, shape):
+        """
+        Counts the matrices that follow each possible row
+        :param shape: (x_len, y_len, z_len) tuple
+        """
+        x_len, y_len, z_len = shape
+        # Each row never decreases, and each row is behind the previous one, so no lower than it
+        self.rows = np.array(list(itertools.combinations_with_replacement(range(z_len + 1), y_len)))
+        self.behind = (self.rows[:, None, :] <= self.rows[None, :, :]).all(axis=2)
+        self.row_index = {tuple(row): i for i, row in enumerate(self.rows.tolist())}
+        # completions[k][r]: number of ways to add k more rows after row r
+        self.completions = np.ones((x_len, len(self.rows)), dtype=np.int64)
+        for k in range(1, x_len):
+            self.completions[k] = self.behind.astype(np.int64) @ self.completions[k - 1]
+        self.count = int(self.completions[-1].sum())
+
+    def unrank(self, index):
+        """
+        Finds the matrix at a position
+        :param index: position of the matrix, lower than count
+        :return: [x_len, y_len] heights matrix
+        """
+        candidates = np.arange(len(self.rows))
+        matrix = []
+        for k in range(len(self.completions) - 1, -1, -1):
+            counts = np.cumsum(self.completions[k, candidates])
+            position = int(np.searchsorted(counts, index, side='right'))
+            if position > 0:
+                index -= int(counts[position - 1])
+            matrix.append(candidates[position])
+            candidates = np.flatnonzero(self.behind[matrix[-1]])
+        return self.rows[matrix]
+
+    def rank(self, heights):
+        """
+        Finds the position of a matrix
+        :param heights: sorted [x_len, y_len] heights matrix
+        :return: position of the matrix
+        """
+        candidates = np.arange(len(self.rows))
+        index = 0
+        for k, row in zip(range(len(self.completions) - 1, -1, -1), heights):
+            row = self.row_index[tuple(int(height) for height in row)]
+            index += int(self.completions[k, candidates[candidates < row]].sum())
+            candidates = np.flatnonzero(self.behind[row])
+        return index
+
+
+def enumerate_heights(shape):
+    """
+    Lists every possible sorted heights matrix, including the one with no cubes
+    'sort_by_heights' only fills a position after the ones behind it ('neighbors_in_front'), with the highest
+    columns first, so no column is higher than the ones behind it in x and y
+    :param shape: (x_len, y_len, z_len) tuple
+    :return: generator of [x_len, y_len] heights matrices
+    """
+    x_len = shape[0]
+    index = HeightsIndex(shape)
+
+    def fill(matrix, candidates):
+        if len(matrix) == x_len:
+            yield index.rows[matrix]
+            return
+        for row in candidates:
+            yield from fill(matrix + [row], np.flatnonzero(index.behind[row]))
+
+    yield from fill([], range(len(index.rows)))
+
+
+def can_enumerate(shape):
+    """
+    Checks if the figures of a shape can be enumerated, with a table of rows small enough and a number of
+    figures that fits in 64 bits
+    :param shape: (x_len, y_len, z_len) tuple
+    :return: whether 'HeightsIndex' can be built for the shape
+    """
+    _, y_len, z_len = shape
+    return math.comb(y_len + z_len, y_len) <= MAX_ENUMERATED_ROWS and count_heights(shape) < 2**63
+
+
 def figure_name(heights, shape):
     """
     Creates figure filename given its column heights and shape
@@ -76,19 +247,21 @@ def figure_name(heights, shape):
     """
     x_len, y_len, z_len = shape
     name = f"cubes_{x_len}_{y_len}_{z_len}"
+    # Heights of one digit are joined, longer ones are separated
+    separator = '' if z_len < 10 else '-'
 
     for row in heights:
         row_str = [str(elem) for elem in row]
-        name += '_' + ''.join(row_str)
+        name += '_' + separator.join(row_str)
 
     return name + ".png"
 
 
-def create_random_figure(args, repeated):
+def random_heights(args):
     """
-    Creates a random figure given input values such as dimension lengths or color palettes
+    Creates a random heights matrix given input values such as dimension lengths or stacking probability
     :param args: input values
-    :param repeated: number of times we tried to create a figure that already exists
+    :return: sorted [x_len, y_len] heights matrix
     """
     x_len = args.x_len
     y_len = args.y_len
@@ -107,83 +280,390 @@ def create_random_figure(args, repeated):
 
     # B) Sort cubes by height (the higher, the farther from the viewer)
     shape = (x_len, y_len, z_len)
-    heights = sort_by_heights(heights, shape)
+    return sort_by_heights(heights, shape)
 
-    # C) Check if this figure has already been created or has no cubes (by checking its filename)
-    filename = figure_name(heights, shape)
-    figure_path = f"{args.output_path}/{filename}"
 
-    if os.path.exists(figure_path) or heights.sum() == 0:
-        if repeated < args.max_repeats:
-            repeated += 1
-            create_random_figure(args, repeated)
-    else:
-        # D) Create voxels and rearrange them to create the picture
-        voxels = []
-        for i in range(z_len):
-            layer = np.array(
-                [[True if elem > i else False for elem in heights[x]] for x in range(x_len)])
-            voxels.append(layer)
-        voxels = np.array(voxels)
-
-        # E) Choose colors for each plane of cubes
-        colors = np.empty(voxels.shape, dtype=object)
-        if args.colormap == 'random':
-            cmap = cm.get_cmap(random.choice(['rainbow', 'viridis', 'cool', 'twilight_shifted', 'brg', 'terrain',
-                                              'ocean', 'winter', 'spring', 'cividis']))
+def random_heights_batch(args, batch_size):
+    """
+    Creates a batch of random heights matrices at once, with the same distribution as 'random_heights'
+    :param args: input values
+    :param batch_size: number of heights matrices
+    :return: [batch_size, x_len, y_len] array of sorted heights matrices
+    """
+    shape = (args.x_len, args.y_len, args.z_len)
+
+    # A) Cubes are stacked with probability prob until one is not, so a column is at least k high with
+    # probability prob^k
+    u = np.random.rand(batch_size, args.x_len, args.y_len)
+    heights = sum(u < args.prob ** k for k in range(1, args.z_len + 1))
+
+    # B) Sort cubes by height (the higher, the farther from the viewer)
+    return sort_by_heights_batch(heights, shape)
+
+
+def random_colormap(colormap):
+    """
+    Chooses the colormap of a figure
+    :param colormap: colormap name or 'random'
+    :return: colormap name
+    """
+    if colormap == 'random':
+        return random.choice(['rainbow', 'viridis', 'cool', 'twilight_shifted', 'brg', 'terrain',
+                              'ocean', 'winter', 'spring', 'cividis'])
+    return colormap
+
+
+def figure_voxels(heights, shape, colormap):
+    """
+    Creates the voxels of a figure and their colors, arranged as they are plotted
+    :param heights: [x_len, y_len] matrix, each value specifying the number of cubes in a column
+    :param shape: (x_len, y_len, z_len) tuple
+    :param colormap: colormap name
+    :return: voxels and colors arrays
+    """
+    x_len, _, z_len = shape
+
+    # D) Create voxels and rearrange them to create the picture
+    voxels = []
+    for i in range(z_len):
+        layer = np.array(
+            [[True if elem > i else False for elem in heights[x]] for x in range(x_len)])
+        voxels.append(layer)
+    voxels = np.array(voxels)
+
+    # E) Choose colors for each plane of cubes
+    colors = np.empty(voxels.shape, dtype=object)
+    cmap = cm.get_cmap(colormap)
+
+    # Assign colors to each voxel
+    for i in range(z_len):
+        r, g, b, a = cmap(i / z_len)
+        str_rgb = '#{:02x}{:02x}{:02x}'.format(
+            int(r * 255), int(g * 255), int(b * 255))
+        colors[i][voxels[i]] = str_rgb
+
+    # Swap axes to visualize better
+    voxels = np.swapaxes(voxels, 0, 2)
+    colors = np.swapaxes(colors, 0, 2)
+
+    return voxels, colors
+
+
+def draw_figure(heights, shape, colormap, figure_path):
+    """
+    Draws a figure given its column heights and saves it
+    :param heights: [x_len, y_len] matrix, each value specifying the number of cubes in a column
+    :param shape: (x_len, y_len, z_len) tuple
+    :param colormap: colormap name
+    :param figure_path: path of the output image
+    """
+    voxels, colors = figure_voxels(heights, shape, colormap)
+
+    # F) Create and save plot
+    fig, ax = create_axes(shape)
+    ax.voxels(voxels, facecolors=colors, edgecolor='k')
+
+    fig.canvas.draw()
+    fig.tight_layout()
+    # The PNG is saved again by the image writer, so it is not compressed here
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png', bbox_inches='tight', pil_kwargs={'compress_level': 0})
+    plt.close()
+    save_image(Image.open(buffer), figure_path)
+
+
+class FigureRenderer:
+    """Draws all the figures of a shape on the same matplotlib figure.
+
+    The figure and its axes are created and laid out once. For each figure only the voxels are
+    replaced, and the canvas is cropped to the bounding box that 'savefig' would use.
+
+    """
+
+    def __init__(self, shape):
+        """Create the figure and the axes for figures of the given shape."""
+
+        self.shape = shape
+        self.fig, self.ax = create_axes(shape)
+        self.fig.canvas.draw()
+        self.fig.tight_layout()
+        self.fig.canvas.draw()
+        self.voxels = {}
+
+        # Cubes are always inside the axes, so the tight bounding box is the same for every figure
+        renderer = self.fig.canvas.get_renderer()
+        bbox = self.fig.get_tightbbox(renderer).padded(plt.rcParams['savefig.pad_inches'])
+        dpi = self.fig.dpi
+        left, top = round(bbox.x0 * dpi), round(self.fig.bbox.height - bbox.y1 * dpi)
+        self.box = (left, top, left + int(bbox.width * dpi), top + int(bbox.height * dpi))
+
+    def draw(self, heights, colormap, figure_path):
+        """Draw a figure given its column heights and save it."""
+
+        for collection in self.voxels.values():
+            collection.remove()
+
+        voxels, colors = figure_voxels(heights, self.shape, colormap)
+        self.voxels = self.ax.voxels(voxels, facecolors=colors, edgecolor='k')
+
+        self.fig.canvas.draw()
+        left, top, right, bottom = self.box
+        # The canvas is drawn again for the next figure, so the image is copied before it is saved
+        image = np.array(self.fig.canvas.buffer_rgba())[top:bottom, left:right]
+        save_image(Image.fromarray(image), figure_path)
+
+
+# One figure renderer per shape, created the first time it is needed in each process
+FIGURE_RENDERERS = {}
+
+
+def draw_figure_persistent(heights, shape, colormap, figure_path):
+    """
+    Draws a figure given its column heights and saves it, reusing the matplotlib figure of its shape
+    :param heights: [x_len, y_len] matrix, each value specifying the number of cubes in a column
+    :param shape: (x_len, y_len, z_len) tuple
+    :param colormap: colormap name
+    :param figure_path: path of the output image
+    """
+    if shape not in FIGURE_RENDERERS:
+        FIGURE_RENDERERS[shape] = FigureRenderer(shape)
+    FIGURE_RENDERERS[shape].draw(heights, colormap, figure_path)
+
+
+# Functions that draw a figure given its heights, shape, colormap and output path
+RENDERERS = {
+    'matplotlib': draw_figure,
+    'persistent': draw_figure_persistent,
+    'fast': draw_figure_fast,
+}
+
+
+def existing_figures(output_path, manifest=None):
+    """
+    Lists the figures that already exist in the output path, so that they are not created again
+    Figures saved in any image format are listed with the name given by 'figure_name'
+    Figures of the manifest are listed too, as the ones sampled with 'skip_render' are not drawn
+    :param output_path: path for output files
+    :param manifest: path of the manifest, if it exists
+    :return: set of figure filenames
+    """
+    if not os.path.isdir(output_path):
+        return set()
+    figures = {os.path.splitext(file)[0] + '.png' for file in os.listdir(output_path)
+               if os.path.splitext(file)[1] in IMAGE_FORMATS.values()}
+    if manifest is not None and os.path.isfile(manifest):
+        with open(manifest, encoding='UTF-8') as lines:
+            figures.update(os.path.splitext(json.loads(line)['image'])[0] + '.png' for line in lines if line.strip())
+    return figures
+
+
+class FigureSampler:
+    """Samples random figures that have not been created yet.
+
+    Existing figures are listed once, and every sampled figure is added to the same in-memory set,
+    so duplicates are rejected without touching the file system. Rejected attempts are counted.
+    Heights matrices are drawn in batches of batch_size, which is much faster than one at a time.
+
+    """
+
+    batch_size = 1024
+
+    def __init__(self, args):
+        """Initialize the sampler with the figures already in the output path."""
+
+        self.args = args
+        self.shape = (args.x_len, args.y_len, args.z_len)
+        self.seen = existing_figures(args.output_path, os.path.join(args.output_path, args.manifest))
+        self.total = args.n
+        # Total attempts, attempts rejected as duplicates or empty, and figures given up after max_repeats
+        self.attempts = 0
+        self.wasted = 0
+        self.failed = 0
+        self.batch = iter(())
+
+    def random_heights(self):
+        """Take the next heights matrix of the current batch, drawing a new batch when it runs out."""
+
+        heights = next(self.batch, None)
+        if heights is None:
+            self.batch = iter(random_heights_batch(self.args, self.batch_size))
+            heights = next(self.batch)
+        return heights
+
+    def sample(self):
+        """Sample a new figure, trying up to max_repeats more times if it already exists or has no cubes.
+
+        Returns:
+            (heights, shape, colormap, figure_path) tuple, or None if every attempt was rejected.
+        """
+        for _ in range(self.args.max_repeats + 1):
+            self.attempts += 1
+            heights = self.random_heights()
+
+            # C) Check if this figure has already been created or has no cubes (by checking its filename)
+            filename = figure_name(heights, self.shape)
+            if filename in self.seen or heights.sum() == 0:
+                self.wasted += 1
+                continue
+
+            self.seen.add(filename)
+            figure_path = image_path(f"{self.args.output_path}/{filename}")
+            return heights, self.shape, random_colormap(self.args.colormap), figure_path
+
+        self.failed += 1
+        return None
+
+    def __iter__(self):
+        """Sample n figures, skipping those that could not be created."""
+
+        for _ in range(self.args.n):
+            figure = self.sample()
+            if figure is not None:
+                yield figure
+
+    def report(self):
+        """Print how many attempts were wasted, which grows as a shape runs out of new figures."""
+
+        wasted = 100 * self.wasted / max(self.attempts, 1)
+        print(f"{self.attempts} attempts, {self.wasted} wasted on existing or empty figures ({wasted:.1f}%).")
+        if self.failed:
+            print(f"WARNING: {self.failed} figures were not created after {self.args.max_repeats} repeats!")
+
+
+class FigureEnumerator:
+    """Lists every figure of a shape that has not been created yet, or n of them chosen at random.
+
+    Unlike random sampling, no attempt is wasted, however close to complete the dataset is.
+
+    """
+
+    def __init__(self, args):
+        """Initialize the enumerator with the figures already in the output path."""
+
+        self.args = args
+        self.shape = (args.x_len, args.y_len, args.z_len)
+        self.index = HeightsIndex(self.shape)
+        seen = existing_figures(args.output_path, os.path.join(args.output_path, args.manifest))
+
+        x_len, y_len, z_len = self.shape
+        prefix = f"cubes_{x_len}_{y_len}_{z_len}_"
+        # Positions of the existing figures, and of the matrix with no cubes, which is not a figure
+        self.excluded = sorted({0} | {self.index.rank(parse_filename(filename)[0])
+                                      for filename in seen if filename.startswith(prefix)})
+        self.figures = self.index.count - 1
+        self.remaining = self.index.count - len(self.excluded)
+        if 0 < args.n < self.remaining:
+            self.total = args.n
+            self.chosen = sorted(random.sample(range(self.remaining), args.n))
         else:
-            cmap = cm.get_cmap(args.colormap)
+            self.total = self.remaining
+            self.chosen = range(self.remaining)
 
-        # Assign colors to each voxel
-        for i in range(z_len):
-            r, g, b, a = cmap(i / z_len)
-            str_rgb = '#{:02x}{:02x}{:02x}'.format(
-                int(r * 255), int(g * 255), int(b * 255))
-            colors[i][voxels[i]] = str_rgb
+    def positions(self):
+        """Find the position of each chosen figure, skipping the excluded ones before it."""
 
-        # Swap axes to visualize better
-        voxels = np.swapaxes(voxels, 0, 2)
-        colors = np.swapaxes(colors, 0, 2)
+        excluded = iter(self.excluded)
+        next_excluded = next(excluded, None)
+        skipped = 0
+        for chosen in self.chosen:
+            while next_excluded is not None and next_excluded <= chosen + skipped:
+                skipped += 1
+                next_excluded = next(excluded, None)
+            yield chosen + skipped
 
-        # F) Create and save plot
-        dpi = 96
-        fig = plt.figure(figsize=(600/dpi, 400/dpi), dpi=dpi)
+    def __iter__(self):
+        """Enumerate the chosen figures in order, finding each one by its position."""
 
-        ax = fig.add_subplot(projection='3d')
-        # Little trick to plot cubes correctly
-        ax.set(xlim=(0, y_len), ylim=(0, x_len), zlim=(0, z_len))
+        for position in self.positions():
+            heights = self.index.unrank(position)
+            filename = figure_name(heights, self.shape)
+            figure_path = image_path(f"{self.args.output_path}/{filename}")
+            yield heights, self.shape, random_colormap(self.args.colormap), figure_path
 
-        # set up the axes labels for the plot
-        ax.set_xlabel('y')
-        ax.set_ylabel('x')
-        ax.set_zlabel('z')
+    def report(self):
+        """Print how many figures of the shape exist and how many were created."""
 
-        # set up the axes ticks for the plot
-        ax.set_xticks(np.arange(0, x_len + 1, 1))
-        ax.set_yticks(np.arange(0, y_len + 1, 1))
-        ax.set_zticks(np.arange(0, z_len + 1, 1))
+        print(f"{self.figures} possible figures, {self.figures - self.remaining} already existed, "
+              f"{self.total} created.")
 
-        # set up the axes tick labels for the plot
-        ax.set_xticklabels(np.arange(0, x_len + 1, 1))
-        ax.set_yticklabels(np.arange(0, y_len + 1, 1))
-        ax.set_zticklabels(np.arange(0, z_len + 1, 1))
 
-        ax.get_xaxis().set_tick_params(direction='out', pad=0)
-        ax.get_yaxis().set_tick_params(direction='out', pad=0)
-        ax.get_zaxis().set_tick_params(direction='out', pad=0)
+def draw_figure_task(renderer, task):
+    """
+    Draws a sampled figure, unpacking the tuple created by 'FigureSampler'
+    The figure is linked from the render cache instead if it was drawn before with the same renderer
+    :param renderer: name of the renderer
+    :param task: (heights, shape, colormap, figure_path) tuple
+    :return: the same task, once the figure is saved
+    """
+    heights, shape, colormap, figure_path = task
+    if not fetch_image(figure_path, scene_key('cubes', renderer, heights, shape, colormap)):
+        RENDERERS[renderer](*task)
+    return task
 
-        ax.view_init(35, -125)
-        ax.voxels(voxels, facecolors=colors, edgecolor='k')
 
-        fig.canvas.draw()
-        fig.tight_layout()
-        plt.savefig(figure_path, bbox_inches='tight')
-        plt.close()
+def read_manifest_figures(filename, output_path):
+    """
+    Reads the figures of a manifest to draw them, with the path of each figure in output_path
+    :param filename: path of the manifest
+    :param output_path: path for output files
+    :return: generator of (heights, shape, colormap, figure_path) tuples
+    """
+    for entry in manifest_entries(filename):
+        yield (np.array(entry['heights'], dtype=int), tuple(entry['shape']), entry['colormap'],
+               image_path(os.path.join(output_path, entry['image'])))
 
 
-def parse_arguments():
+def draw_figures(args, writer, figures, total):
+    """
+    Draws figures in this process, or in a pool of workers that save their own figures
+    :param args: input values
+    :param writer: image writer of this process
+    :param figures: iterable of (heights, shape, colormap, figure_path) tuples
+    :param total: number of figures
+    :return: generator of the drawn figures, in any order
+    """
+    if args.workers == 1:
+        with writer:
+            yield from tqdm(map(partial(draw_figure_task, args.renderer), figures), total=total, desc="Images")
+    else:
+        # Figures are sampled in this process, so that duplicates are rejected in a single place
+        # and the result does not depend on the number of workers. Only drawing is parallel.
+        with Pool(args.workers, use_writer, (writer.synchronous(),)) as pool:
+            tasks = pool.imap_unordered(partial(draw_figure_task, args.renderer), figures)
+            yield from tqdm(tasks, total=total, desc="Images")
+
+
+def manifest_entry(heights, shape, colormap, figure_path):
+    """
+    Creates the manifest line of a figure, with the parameters needed to create its questions
+    :param heights: [x_len, y_len] matrix, each value specifying the number of cubes in a column
+    :param shape: (x_len, y_len, z_len) tuple
+    :param colormap: name of the colormap
+    :param figure_path: path of the figure
+    :return: JSON line
+    """
+    entry = {
+        'image': os.path.basename(figure_path),
+        'shape': list(shape),
+        'heights': heights.tolist(),
+        'colormap': colormap,
+    }
+    return json.dumps(entry) + '\n'
+
+
+def report_cache(cache):
+    """
+    Removes the least recently used images of the render cache and prints its size
+    :param cache: render cache
+    """
+    images, size, removed = cache.trim()
+    print(f"Render cache: {images} images ({size / 2**20:.1f} MB), {removed} least recently used removed.")
+
+
+def parse_arguments(argv=None):
     """
     Parse input values
+    :param argv: values to parse instead of the ones of the command line
     :return: input values
     """
     parser = argparse.ArgumentParser()
@@ -246,7 +726,105 @@ def parse_arguments():
         help="Path for output files.",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default='manifest.jsonl',
+        help="Name of the manifest in output_path. A JSON line with the parameters of each created figure is "
+             "appended to it.",
+    )
+
+    parser.add_argument(
+        "--enumerate",
+        action='store_true',
+        help="List every possible figure instead of sampling them, and create n of them chosen at random "
+             "among the ones that do not exist yet. With n 0, create all of them.",
+    )
+
+    parser.add_argument(
+        "--renderer",
+        type=str,
+        default='matplotlib',
+        choices=['matplotlib', 'persistent', 'fast'],
+        help="Renderer of the figures. 'persistent' reuses the same matplotlib figure for every image. "
+             "'fast' draws them with PIL over axes drawn once per shape with matplotlib, "
+             "creating images about 12 times faster.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to draw the figures.",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed. The same seed creates the same figures for any number of workers.",
+    )
+
+    parser.add_argument(
+        "--image_format",
+        type=str,
+        default='png',
+        choices=list(IMAGE_FORMATS),
+        help="Format of the images. 'webp' is lossless.",
+    )
+
+    parser.add_argument(
+        "--compress_level",
+        type=int,
+        default=6,
+        help="Compression level of PNG images, between 0 (fastest) and 9 (smallest).",
+    )
+
+    parser.add_argument(
+        "--palette",
+        action='store_true',
+        help="Save PNG images with at most 256 colors in palette mode, smaller and faster to encode.",
+    )
+
+    parser.add_argument(
+        "--writer_threads",
+        type=int,
+        default=1,
+        help="Number of threads that save the images while the next ones are drawn. With 0, images are "
+             "saved after drawing each one. Worker processes save their own images.",
+    )
+
+    parser.add_argument(
+        "--skip_render",
+        action='store_true',
+        help="Only sample the figures and append them to the manifest, without drawing them. Questions can be "
+             "created from the manifest, and the figures drawn later with render_manifest.",
+    )
+
+    parser.add_argument(
+        "--render_manifest",
+        type=str,
+        default=None,
+        help="Draw the figures of this manifest in output_path, like a subset of one created with skip_render, "
+             "instead of sampling new ones.",
+    )
+
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="Directory of the render cache. Figures drawn before with the same colormap, renderer and image "
+             "options are linked from it instead of drawn again.",
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=1024,
+        help="Maximum size of the render cache in MB. The least recently used images are removed at the end.",
+    )
+
+    return parser.parse_args(argv)
 
 
 def check_args(args):
@@ -287,6 +865,23 @@ def check_args(args):
         args.prob = 0.75
         print("WARNING: Probability of spawning a cube should be between 0.0 and 1.0 (not inclusive). Default: 0.75.")
 
+    if args.enumerate and not can_enumerate((args.x_len, args.y_len, args.z_len)):
+        args.enumerate = False
+        print("WARNING: The shape has too many figures to enumerate! They are sampled instead, which seldom "
+              "repeats a figure with so many.")
+
+    if args.workers < 1:
+        args.workers = 1
+        print("WARNING: At least one worker is needed! Lower values have been set to 1.")
+
+    if args.writer_threads < 0:
+        args.writer_threads = 0
+        print("WARNING: The number of writer threads cannot be negative! Lower values have been set to 0.")
+
+    if not 0 <= args.compress_level <= 9:
+        args.compress_level = min(max(args.compress_level, 0), 9)
+        print("WARNING: Compression level should be between 0 and 9! It has been set to the nearest one.")
+
     return args
 
 
@@ -295,8 +890,32 @@ def main():
     args = parse_arguments()
     args = check_args(args)
 
-    for _ in tqdm(range(args.n), total=args.n, desc="Images"):
-        create_random_figure(args, repeated=0)
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+
+    cache = RenderCache(args.cache_path, args.cache_size * 2**20) if args.cache_path else None
+    writer = ImageWriter(args.image_format, args.compress_level, args.palette, args.writer_threads, cache=cache)
+    use_writer(writer)
+    if args.render_manifest:
+        # Figures of the manifest are only drawn, so nothing is appended to the manifest of output_path
+        figures = list(read_manifest_figures(args.render_manifest, args.output_path))
+        for _ in draw_figures(args, writer, figures, len(figures)):
+            pass
+    else:
+        sampler = FigureEnumerator(args) if args.enumerate else FigureSampler(args)
+        if args.skip_render:
+            figures = tqdm(sampler, total=sampler.total, desc="Figures")
+        else:
+            figures = draw_figures(args, writer, sampler, sampler.total)
+        # Created figures are appended to the manifest as soon as they are drawn, and the writer raises
+        # any error saving them before the manifest is closed
+        with open(os.path.join(args.output_path, args.manifest), 'a', encoding='UTF-8') as manifest:
+            for figure in figures:
+                manifest.write(manifest_entry(*figure))
+        sampler.report()
+    if cache is not None:
+        report_cache(cache)
 
 
 if __name__ == '__main__':
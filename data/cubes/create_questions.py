@@ -1,11 +1,19 @@
 """This module is used to generate questions for cube figures."""
 import argparse
+import itertools
 import os
 import random
-import csv
+import sys
 import numpy as np
 from tqdm import tqdm
 
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.question_files import manifest_entries, write_questions
+
 
 def parse_filename(filename):
     """
@@ -13,7 +21,8 @@ def parse_filename(filename):
     :param filename: filename of the figure
     :return: heights and shape of figure
     """
-    name = filename[:-4]
+    # Extensions have different lengths, like .png and .webp
+    name = os.path.splitext(filename)[0]
     values = name.split('_')
     x_len, y_len, z_len = int(values[1]), int(values[2]), int(values[3])
 
@@ -21,12 +30,35 @@ def parse_filename(filename):
     shape = (x_len, y_len, z_len)
 
     for x in range(x_len):
+        # Heights of more than one digit are separated
+        row = values[x + 4].split('-') if z_len >= 10 else values[x + 4]
         for y in range(y_len):
-            heights[x][y] = int(values[x + 4][y])
+            heights[x][y] = int(row[y])
 
     return heights, shape
 
 
+def list_figures(path):
+    """
+    Lists the figures in a given path, parsing their filenames
+    :param path: directory of the figures
+    :return: generator of (filename, heights, shape) tuples
+    """
+    for file in os.listdir(path):
+        if os.path.splitext(file)[1] in ('.png', '.webp'):
+            yield (file, *parse_filename(file))
+
+
+def read_manifest(filename):
+    """
+    Reads the figures of a manifest created by 'create_images.py', one line at a time
+    :param filename: path of the manifest
+    :return: generator of (filename, heights, shape) tuples
+    """
+    for entry in manifest_entries(filename):
+        yield entry['image'], np.array(entry['heights'], dtype=int), tuple(entry['shape'])
+
+
 def visible_cubes(heights, x_len, y_len):
     """
     Computes how many cubes are visible from our perspective
@@ -59,6 +91,33 @@ def visible_cubes(heights, x_len, y_len):
     return value
 
 
+def cube_counts(heights, z_len):
+    """
+    Counts cubes for a stack of heights matrices of the same shape at once
+    A cube is visible if it is higher than the lowest of the columns in front of it, like in 'visible_cubes'
+    :param heights: [n, x_len, y_len] array of heights matrices
+    :param z_len: number of layers in axis Z
+    :return: dictionary with the total and visible cubes of each figure ([n] arrays)
+    and the cubes in each layer of axis X ([n, x_len]), Y ([n, y_len]) and Z ([n, z_len])
+    """
+    n, x_len, y_len = heights.shape
+
+    # Heights of the columns in front, with empty columns outside the matrix
+    padded = np.zeros((n, x_len + 1, y_len + 1), dtype=heights.dtype)
+    padded[:, 1:, 1:] = heights
+    front = np.minimum(padded[:, :-1, 1:], padded[:, 1:, :-1])
+    visible = np.maximum(heights - front, heights > 0)
+
+    layers = np.arange(1, z_len + 1)
+    return {
+        'total': heights.sum(axis=(1, 2)),
+        'visible': visible.sum(axis=(1, 2)),
+        'x': heights.sum(axis=2),
+        'y': heights.sum(axis=1),
+        'z': (heights[..., np.newaxis] >= layers).sum(axis=(1, 2)),
+    }
+
+
 def wrong_answers(correct):
     """Create wrong answers for a given correct answer.
 
@@ -79,79 +138,101 @@ def wrong_answers(correct):
     return answers[1], answers[2]
 
 
-def create_questions(path):
+def count_figures(figures):
     """
-    Creates question(s) for a list of figures in a given path
-    :param path: directory of the figures
-    :param q_type: specifies which question types are going to be created
-    :return: list of question, answers and figure filename (5 values)
+    Counts the cubes of a list of figures, grouped by shape so that the cubes of each group are counted at once
+    :param figures: list of (filename, heights, shape) tuples
+    :return: list of dictionaries with the counts of each figure, as returned by 'cube_counts'
     """
-    question_list = []
-    list_of_images = [file for file in os.listdir(path) if '.png' in file]
-    n = len(list_of_images)
+    groups = {}
+    for i, (_, _, shape) in enumerate(figures):
+        groups.setdefault(shape, []).append(i)
+
+    counts = [None] * len(figures)
+    for shape, indices in groups.items():
+        shape_counts = cube_counts(np.stack([figures[i][1] for i in indices]), shape[2])
+        for j, i in enumerate(indices):
+            counts[i] = {key: value[j] for key, value in shape_counts.items()}
+
+    return counts
 
-    category = "Cubes"
 
-    for file in tqdm(list_of_images, desc='Questions', total=n):
+def figure_questions(file, shape, count):
+    """
+    Creates the questions of a figure given its cube counts
+    :param file: filename of the figure
+    :param shape: (x_len, y_len, z_len) tuple
+    :param count: dictionary with the counts of the figure, as returned by 'count_figures'
+    :return: list of question, answers and figure filename
+    """
+    question_list = []
+    x_len, y_len, z_len = shape
 
-        heights, shape = parse_filename(file)
-        x_len, y_len, z_len = shape
+    category = "Cubes"
 
-        question = "How many cubes in total?"
-        correct = int(heights.sum())
+    question = "How many cubes in total?"
+    correct = int(count['total'])
+    wrong1, wrong2 = wrong_answers(correct)
+    question_list.append(
+        [category, question, correct, wrong1, wrong2, file])
+
+    question = "How many visible cubes?"
+    correct = int(count['visible'])
+    wrong1, wrong2 = wrong_answers(correct)
+    question_list.append(
+        [category, question, correct, wrong1, wrong2, file])
+
+    question = "How many non visible cubes?"
+    correct = int(count['total'] - count['visible'])
+    wrong1, wrong2 = wrong_answers(correct)
+    question_list.append(
+        [category, question, correct, wrong1, wrong2, file])
+
+    for x in range(1, x_len + 1):
+        question = f"How many cubes in layer x {x}?"
+        correct = int(count['x'][x - 1])
         wrong1, wrong2 = wrong_answers(correct)
         question_list.append(
             [category, question, correct, wrong1, wrong2, file])
 
-        question = "How many visible cubes?"
-        correct = visible_cubes(heights, x_len, y_len)
+    for y in range(1, y_len + 1):
+        question = f"How many cubes in layer y {y}?"
+        correct = int(count['y'][y - 1])
         wrong1, wrong2 = wrong_answers(correct)
         question_list.append(
             [category, question, correct, wrong1, wrong2, file])
 
-        question = "How many non visible cubes?"
-        correct =  int(heights.sum()) - visible_cubes(heights, x_len, y_len)
+    for z in range(1, z_len + 1):
+        question = f"How many cubes in layer z {z}?"
+        correct = int(count['z'][z - 1])
         wrong1, wrong2 = wrong_answers(correct)
         question_list.append(
             [category, question, correct, wrong1, wrong2, file])
 
-        for x in range(1, x_len + 1):
-            question = f"How many cubes in layer x {x}?"
-            correct = int((heights[x - 1, :]).sum())
-            wrong1, wrong2 = wrong_answers(correct)
-            question_list.append(
-                [category, question, correct, wrong1, wrong2, file])
-
-        for y in range(1, y_len + 1):
-            question = f"How many cubes in layer y {y}?"
-            correct = int((heights[:, y - 1]).sum())
-            wrong1, wrong2 = wrong_answers(correct)
-            question_list.append(
-                [category, question, correct, wrong1, wrong2, file])
-
-        for z in range(1, z_len + 1):
-            question = f"How many cubes in layer z {z}?"
-            correct = int((heights >= z).sum())
-            wrong1, wrong2 = wrong_answers(correct)
-            question_list.append(
-                [category, question, correct, wrong1, wrong2, file])
-
     return question_list
 
 
-def write_questions(question_list, filename):
+def create_questions(path, manifest=None, chunk_size=10000):
     """
-    Saves questions in a file
-    :param question_list: question list to be saved
-    :param filename: name of the output filename
+    Creates question(s) for a list of figures in a given path
+    Figures are read from the manifest if given, or from the filenames in path otherwise,
+    and their cubes are counted in chunks of chunk_size figures
+    :param path: directory of the figures
+    :param manifest: path of the manifest created by 'create_images.py'
+    :param chunk_size: number of figures counted at once
+    :return: generator of question, answers and figure filename (5 values)
     """
-    with open(filename, 'w', encoding='UTF-8', newline='') as csvfile:
-        writer = csv.writer(csvfile, delimiter=',',
-                            quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        writer.writerow(['type', 'question', 'correct',
-                         'wrong1', 'wrong2', 'image'])
-        for question in question_list:
-            writer.writerow(question)
+    figures = read_manifest(manifest) if manifest else list_figures(path)
+
+    with tqdm(desc='Questions') as progress:
+        while True:
+            chunk = list(itertools.islice(figures, chunk_size))
+            if not chunk:
+                break
+
+            for (file, _, shape), count in zip(chunk, count_figures(chunk)):
+                yield from figure_questions(file, shape, count)
+            progress.update(len(chunk))
 
 
 def parse_arguments():
@@ -168,11 +249,27 @@ def parse_arguments():
         help="Path for input images.",
     )
 
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="Manifest created by create_images.py. If not given, figures are parsed from the filenames in "
+             "image_path.",
+    )
+
     parser.add_argument(
         "--filename",
         type=str,
         default='questions.csv',
-        help="Path for output file.",
+        help="Path for output file. Compressed with gzip if it ends with .gz.",
+    )
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        default='csv',
+        choices=['csv', 'parquet'],
+        help="Format of the output file. 'parquet' needs pyarrow.",
     )
 
     return parser.parse_args()
@@ -181,8 +278,8 @@ def parse_arguments():
 def main():
     """Main function"""
     args = parse_arguments()
-    question_list = create_questions(args.image_path)
-    write_questions(question_list, args.filename)
+    question_list = create_questions(args.image_path, args.manifest)
+    write_questions(question_list, args.filename, args.format)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+"""This module creates cube figures and their questions when they are used, as a dataset that does not use the disk."""
+import os
+import random
+import sys
+from argparse import Namespace
+
+import numpy as np
+
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.datasets import kept_random_state, to_rgb
+from common.image_writer import capture_images
+from create_images import draw_figure_task, figure_name, random_colormap, random_heights
+from create_questions import count_figures, figure_questions
+
+
+class CubesDataset:
+    """Questions of n random cube figures, drawn in memory when they are used.
+
+    Figure i is sampled from the seed and i, so every item is the same in any process, and the dataset can
+    be read by several workers, like the ones of a PyTorch DataLoader. Each item is an
+    (image, question, correct, wrong1, wrong2) tuple, where image is a [height, width, 3] uint8 array.
+    Questions of a figure are consecutive items, and the last figure is kept, so each figure is drawn
+    only once when items are read in order. Unlike 'create_images.py', figures may be repeated. Images are
+    converted to RGB like 'evaluate.py' does, over a white background with white_background.
+
+    """
+
+    def __init__(self, n, x_len=4, y_len=4, z_len=3, prob=0.75, colormap='random', renderer='fast', seed=0,
+                 white_background=False):
+        """
+        Creates the dataset, no figure is drawn until it is used
+        :param n: number of figures
+        :param x_len: number of cubes in axis X
+        :param y_len: number of cubes in axis Y
+        :param z_len: number of cubes in axis Z
+        :param prob: probability to stack a cube on top of another
+        :param colormap: colormap of the cubes, or 'random'
+        :param renderer: name of the renderer, 'fast' is much faster than the matplotlib ones
+        :param seed: random seed of the dataset
+        :param white_background: draw the images over a white background where they are transparent
+        """
+        self.n = n
+        self.args = Namespace(x_len=x_len, y_len=y_len, z_len=z_len, prob=prob, colormap=colormap)
+        self.shape = (x_len, y_len, z_len)
+        self.renderer = renderer
+        self.seed = seed
+        self.white_background = white_background
+        # Total, visible and non visible cubes, and cubes in each layer of each axis
+        self.questions_per_figure = 3 + x_len + y_len + z_len
+        self.last = None
+
+    def __len__(self):
+        return self.n * self.questions_per_figure
+
+    def figure(self, i):
+        """
+        Samples figure i, draws it and creates its questions
+        :param i: index of the figure
+        :return: [height, width, 3] image array and list of (question, correct, wrong1, wrong2) tuples
+        """
+        if self.last is not None and self.last[0] == i:
+            return self.last[1]
+
+        with kept_random_state():
+            random.seed(f"{self.seed}_{i}")
+            np.random.seed(random.randrange(2**32))
+            heights = random_heights(self.args)
+            while heights.sum() == 0:
+                heights = random_heights(self.args)
+            colormap = random_colormap(self.args.colormap)
+
+            name = figure_name(heights, self.shape)
+            with capture_images() as images:
+                draw_figure_task(self.renderer, (heights, self.shape, colormap, name))
+            image = to_rgb(images[name], self.white_background)
+
+            count = count_figures([(name, heights, self.shape)])[0]
+            questions = [tuple(question[1:5]) for question in figure_questions(name, self.shape, count)]
+        self.last = (i, (image, questions))
+        return image, questions
+
+    def __getitem__(self, index):
+        """
+        Gets a question of a figure, drawing the figure if it is not the last one
+        :param index: index of the question, the questions of figure i start at i * questions_per_figure
+        :return: (image, question, correct, wrong1, wrong2) tuple
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Question index out of range")
+
+        i, question = divmod(index, self.questions_per_figure)
+        image, questions = self.figure(i)
+        return (image, *questions[question])
+
+    def __iter__(self):
+        """Draws each figure once and yields its questions."""
+
+        for i in range(self.n):
+            image, questions = self.figure(i)
+            for question in questions:
+                yield (image, *question)
@@ -0,0 +1,200 @@
+"""This module draws cube figures with PIL, drawing the axes of each shape with matplotlib only once."""
+import functools
+import io
+import os
+import sys
+
+import matplotlib.cm as cm
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.artist import Artist
+from mpl_toolkits.mplot3d import proj3d
+from PIL import Image, ImageDraw
+
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.image_writer import save_image
+from figure_axes import create_axes
+
+# Cubes are drawn at SCALE times the final size and then reduced, as a cheap antialiasing
+SCALE = 2
+# Edges of matplotlib voxels are 1 point wide, but their antialiased lines are closest to 1 pixel wide ones
+EDGE_WIDTH = 1
+# Box aspect of matplotlib 3D axes and view of 'figure_axes.create_axes'
+BOX_ASPECT = np.array([4, 4, 3])
+ELEV, AZIM = 35, -125
+
+
+class LatticeProbe(Artist):
+    """Artist that draws nothing, but records where points of the axes are drawn.
+
+    Positions are the ones of the last time the axes were drawn, in pixels from the top left corner of the
+    whole canvas.
+
+    """
+
+    def __init__(self, points):
+        """
+        Creates the probe
+        :param points: [n, 3] array of data coordinates
+        """
+        super().__init__()
+        self.points = points
+        self.pixels = None
+        self.set_in_layout(False)
+
+    def draw(self, renderer):
+        """Projects the points like the voxels of the axes, to pixels from the top left corner."""
+
+        xs, ys, zs = self.points.T
+        xs, ys, _ = proj3d.proj_transform(xs, ys, zs, self.axes.M)
+        display = self.axes.transData.transform(np.column_stack([xs, ys]))
+        self.pixels = np.column_stack([display[:, 0], renderer.height - display[:, 1]])
+
+
+@functools.lru_cache(maxsize=None)
+def axes_background(shape):
+    """
+    Draws the 3D axes of a shape with matplotlib once, like 'create_images.draw_figure' without cubes,
+    and finds the pixel position of every corner of every possible cube
+    Cubes are always inside the axes, so the tight bounding box and the projection are the ones of every
+    figure of the shape
+    :param shape: (x_len, y_len, z_len) tuple
+    :return: RGBA image of the axes, box of the lattice in the image (left, top, right, bottom), and
+    [plot x, plot y, z] nested lists with the pixel position of each corner in the supersampled box
+    """
+    x_len, y_len, z_len = shape
+    grid = np.stack(np.meshgrid(np.arange(y_len + 1), np.arange(x_len + 1), np.arange(z_len + 1),
+                                indexing='ij'), axis=-1)
+    probe = LatticeProbe(grid.reshape(-1, 3).astype(float))
+
+    fig, ax = create_axes(shape)
+    # Voxels set the limits of the axes, even if there are none
+    ax.voxels(np.zeros((y_len, x_len, z_len), dtype=bool))
+    ax.add_artist(probe)
+    fig.canvas.draw()
+    fig.tight_layout()
+    fig.canvas.draw()
+    # Points are drawn in the whole canvas, and the saved image starts at the corner of the tight bounding box
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(plt.rcParams['savefig.pad_inches'])
+    corner = np.array([bbox.x0 * fig.dpi, fig.bbox.height - bbox.y1 * fig.dpi])
+    pixels = (probe.pixels - corner).reshape(grid.shape[:-1] + (2,)) * SCALE
+
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png', bbox_inches='tight', pil_kwargs={'compress_level': 0})
+    plt.close()
+    image = Image.open(buffer)
+    image.load()
+
+    # Cubes are drawn in a layer that only covers the lattice, with a pixel of margin for their edges
+    left, top = np.floor(pixels.reshape(-1, 2).min(axis=0) / SCALE).astype(int) - 1
+    right, bottom = np.ceil(pixels.reshape(-1, 2).max(axis=0) / SCALE).astype(int) + 1
+    pixels -= np.array([left, top]) * SCALE
+    box = (int(left), int(top), int(right), int(bottom))
+    return image, box, [[[tuple(p) for p in row] for row in plane] for plane in pixels.tolist()]
+
+
+def view_direction():
+    """
+    Computes the direction from the center of the box to the viewer
+    :return: unit vector in scaled box coordinates
+    """
+    elev, azim = np.deg2rad(ELEV), np.deg2rad(AZIM)
+    return np.array([np.cos(elev) * np.cos(azim), np.cos(elev) * np.sin(azim), np.sin(elev)])
+
+
+def face_shades():
+    """
+    Computes how much light receives each visible face, like matplotlib's default light source
+    :return: shades of the top face and of the faces looking to -x and -y
+    """
+    az, alt = np.deg2rad(90 - 225), np.deg2rad(19.4712)
+    light = np.array([np.cos(az) * np.cos(alt), np.sin(az) * np.cos(alt), np.sin(alt)])
+    normals = np.array([[0, 0, 1], [-1, 0, 0], [0, -1, 0]])
+    return 0.3 + 0.7 * (normals @ light + 1) / 2
+
+
+SHADES = face_shades()
+
+
+@functools.lru_cache(maxsize=None)
+def layer_colors(colormap, z_len):
+    """
+    Computes the color of each layer of cubes, shaded for each visible face
+    :param colormap: colormap name
+    :param z_len: number of layers
+    :return: [z_len][3] nested lists with the RGB color of the top, -x and -y faces of each layer
+    """
+    cmap = cm.get_cmap(colormap)
+    colors = np.array([[int(c * 255) for c in cmap(i / z_len)[:3]] for i in range(z_len)])
+    shaded = np.round(colors[:, np.newaxis, :] * SHADES[np.newaxis, :, np.newaxis]).astype(int)
+    return [[tuple(face) for face in layer] for layer in shaded.tolist()]
+
+
+def draw_cubes(draw, heights, shape, colormap):
+    """
+    Draws the visible faces of the cubes, from the farthest to the closest one
+    :param draw: ImageDraw of the supersampled layer of the cubes, over the box of the lattice
+    :param heights: [x_len, y_len] matrix, each value specifying the number of cubes in a column
+    :param shape: (x_len, y_len, z_len) tuple
+    :param colormap: colormap name
+    """
+    x_len, y_len, z_len = shape
+    colors = layer_colors(colormap, z_len)
+    heights = np.asarray(heights).tolist()
+
+    # Heights matrix rows go along plot axis y and columns along plot axis x
+    cubes = np.array([(y, x, z) for x in range(x_len) for y in range(y_len) for z in range(heights[x][y])])
+    if len(cubes) == 0:
+        return
+    # Both horizontal axes end at the largest of x_len and y_len, as their ticks expand their limits
+    limits = np.array([max(x_len, y_len), max(x_len, y_len), z_len])
+    centers = (cubes + 0.5) / limits * BOX_ASPECT
+    cubes = cubes[np.argsort(centers @ view_direction(), kind='stable')]
+
+    _, _, corners = axes_background(shape)
+    edge_width = EDGE_WIDTH * SCALE
+    for y, x, z in cubes.tolist():
+        faces = []
+        if z == heights[x][y] - 1:
+            faces.append((0, [corners[y][x][z + 1], corners[y + 1][x][z + 1],
+                              corners[y + 1][x + 1][z + 1], corners[y][x + 1][z + 1]]))
+        if y == 0 or heights[x][y - 1] <= z:
+            faces.append((1, [corners[y][x][z], corners[y][x + 1][z],
+                              corners[y][x + 1][z + 1], corners[y][x][z + 1]]))
+        if x == 0 or heights[x - 1][y] <= z:
+            faces.append((2, [corners[y][x][z], corners[y + 1][x][z],
+                              corners[y + 1][x][z + 1], corners[y][x][z + 1]]))
+        for face, polygon in faces:
+            draw.polygon(polygon, fill=colors[z][face], outline='black', width=edge_width)
+
+
+def render_figure(heights, shape, colormap):
+    """
+    Renders a figure given its column heights
+    :param heights: [x_len, y_len] matrix, each value specifying the number of cubes in a column
+    :param shape: (x_len, y_len, z_len) tuple
+    :param colormap: colormap name
+    :return: RGBA image of the size of the matplotlib one, cropped to the same tight bounding box
+    """
+    background, box, _ = axes_background(shape)
+    left, top, right, bottom = box
+    cubes = Image.new('RGBA', ((right - left) * SCALE, (bottom - top) * SCALE), (0, 0, 0, 0))
+    draw_cubes(ImageDraw.Draw(cubes), heights, shape, colormap)
+    image = background.copy()
+    image.alpha_composite(cubes.reduce(SCALE), (left, top))
+    return image
+
+
+def draw_figure_fast(heights, shape, colormap, figure_path):
+    """
+    Draws a figure given its column heights and saves it, like 'create_images.draw_figure'
+    :param heights: [x_len, y_len] matrix, each value specifying the number of cubes in a column
+    :param shape: (x_len, y_len, z_len) tuple
+    :param colormap: colormap name
+    :param figure_path: path of the output image
+    """
+    save_image(render_figure(heights, shape, colormap), figure_path)
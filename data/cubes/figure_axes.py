@@ -0,0 +1,42 @@
+"""This module creates the matplotlib axes where cube figures are plotted."""
+import matplotlib.pyplot as plt
+import numpy as np
+
+
+def create_axes(shape):
+    """
+    Creates the figure and the 3D axes where cubes are plotted
+    :param shape: (x_len, y_len, z_len) tuple
+    :return: figure and axes
+    """
+    x_len, y_len, z_len = shape
+
+    dpi = 96
+    fig = plt.figure(figsize=(600/dpi, 400/dpi), dpi=dpi)
+
+    ax = fig.add_subplot(projection='3d')
+    # Little trick to plot cubes correctly
+    ax.set(xlim=(0, y_len), ylim=(0, x_len), zlim=(0, z_len))
+
+    # set up the axes labels for the plot
+    ax.set_xlabel('y')
+    ax.set_ylabel('x')
+    ax.set_zlabel('z')
+
+    # set up the axes ticks for the plot
+    ax.set_xticks(np.arange(0, x_len + 1, 1))
+    ax.set_yticks(np.arange(0, y_len + 1, 1))
+    ax.set_zticks(np.arange(0, z_len + 1, 1))
+
+    # set up the axes tick labels for the plot
+    ax.set_xticklabels(np.arange(0, x_len + 1, 1))
+    ax.set_yticklabels(np.arange(0, y_len + 1, 1))
+    ax.set_zticklabels(np.arange(0, z_len + 1, 1))
+
+    ax.get_xaxis().set_tick_params(direction='out', pad=0)
+    ax.get_yaxis().set_tick_params(direction='out', pad=0)
+    ax.get_zaxis().set_tick_params(direction='out', pad=0)
+
+    ax.view_init(35, -125)
+
+    return fig, ax
@@ -0,0 +1,65 @@
+"""Tests that the cubes counted for a stack of figures at once are the ones counted for each figure, and that
+figures are parsed back from their filenames."""
+import numpy as np
+import pytest
+
+from create_images import enumerate_heights, figure_name
+from create_questions import cube_counts, parse_filename, visible_cubes
+
+
+def expected_counts(heights, z_len):
+    """
+    Counts the cubes of a single figure, with 'visible_cubes' and the sums of each layer
+    :param heights: [x_len, y_len] heights matrix
+    :param z_len: number of layers in axis Z
+    :return: dictionary with the counts of the figure, like 'cube_counts'
+    """
+    x_len, y_len = heights.shape
+    return {
+        'total': sum(sum(row) for row in heights),
+        'visible': visible_cubes(heights.tolist(), x_len, y_len),
+        'x': [sum(heights[x][y] for y in range(y_len)) for x in range(x_len)],
+        'y': [sum(heights[x][y] for x in range(x_len)) for y in range(y_len)],
+        'z': [sum(int(heights[x][y] >= z) for x in range(x_len) for y in range(y_len)) for z in range(1, z_len + 1)],
+    }
+
+
+def check_counts(heights, z_len):
+    """
+    Checks the counts of a stack of heights matrices against the ones of each matrix
+    :param heights: [n, x_len, y_len] array of heights matrices
+    :param z_len: number of layers in axis Z
+    """
+    counts = cube_counts(heights, z_len)
+    for i, matrix in enumerate(heights):
+        for key, value in expected_counts(matrix, z_len).items():
+            assert np.array_equal(counts[key][i], value), (key, matrix)
+
+
+def test_sorted_figures():
+    """Every sorted figure of the default shape."""
+
+    shape = (4, 4, 3)
+    check_counts(np.stack(list(enumerate_heights(shape))), shape[2])
+
+
+@pytest.mark.parametrize('shape', [(4, 4, 3), (1, 5, 2), (5, 1, 4), (3, 6, 12)])
+def test_unsorted_figures(shape):
+    """Random heights matrices, which are not sorted like the ones of the figures."""
+
+    x_len, y_len, z_len = shape
+    heights = np.random.default_rng(0).integers(0, z_len + 1, (500, x_len, y_len))
+    check_counts(heights, z_len)
+
+
+@pytest.mark.parametrize('extension', ['.png', '.webp'])
+@pytest.mark.parametrize('shape', [(4, 4, 3), (2, 3, 12)])
+def test_parse_filename(shape, extension):
+    """Filenames of any image format, with heights of one digit or separated ones."""
+
+    x_len, y_len, z_len = shape
+    heights = np.random.default_rng(0).integers(0, z_len + 1, (x_len, y_len))
+    filename = figure_name(heights, shape)[:-len('.png')] + extension
+    parsed, parsed_shape = parse_filename(filename)
+    assert parsed_shape == shape
+    assert np.array_equal(parsed, heights)
@@ -0,0 +1,410 @@
+"""This module answers the questions of each task with a VQA model, and writes the answers to their questions file.
+
+Questions are grouped by image, so each image is loaded and preprocessed once, and the questions of a batch of
+images are answered together, with a single pass of the model over the images of the batch.
+"""
+import argparse
+import os
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+from tqdm import tqdm
+
+from common.datasets import rgb_image
+
+TASKS = ['cubes', 'figures', 'maze']
+
+# Answers in words that are compared as the numbers of the correct answers
+WORD2INT = {"one": "1", "two": "2", "three": "3", "four": "4", "red": "1",
+            "blue": "2", "yellow": "3", "left": "1"}
+
+
+def load_image(filename, white_background=False):
+    """Load an image as RGB, like the notebook does, or over a white background where it is transparent.
+
+    Args:
+        filename (str): path of the image.
+        white_background (bool): draw transparent images over a white background.
+
+    Returns:
+        Image: RGB image.
+    """
+    with Image.open(filename) as image:
+        return rgb_image(image, white_background)
+
+
+class DummyModel:
+    """Model that answers a digit from the question and the pixels of its image, without any dependency.
+
+    Answers are the same in every run, so it can be used to test the evaluation offline. It counts the
+    images it preprocesses and the passes over them, which are one for each batch of images.
+
+    """
+
+    def __init__(self, image_size=32):
+        """Create the model.
+
+        Args:
+            image_size (int): size of the square images the model is given.
+        """
+        self.image_size = image_size
+        self.images = 0
+        self.passes = 0
+
+    def preprocess(self, images):
+        """Resize a batch of images.
+
+        Args:
+            images (list): RGB images.
+
+        Returns:
+            numpy.ndarray: [images, image_size, image_size, 3] uint8 array.
+        """
+        self.images += len(images)
+        size = (self.image_size, self.image_size)
+        return np.stack([np.asarray(image.resize(size, Image.BILINEAR)) for image in images])
+
+    def answer(self, images, index, questions):
+        """Answer the questions of a batch of images.
+
+        Args:
+            images: preprocessed images of the batch.
+            index (numpy.ndarray): position in the batch of the image of each question.
+            questions (list): questions to answer.
+
+        Returns:
+            list: answer of each question.
+        """
+        self.passes += 1
+        checksums = [zlib.crc32(image.tobytes()) for image in images]
+        return [str(zlib.crc32(question.encode(), checksums[i]) % 10) for i, question in zip(index, questions)]
+
+
+class BlipModel:
+    """BLIP VQA model, which needs torch, torchvision and the BLIP repository.
+
+    The vision transformer encodes each image of a batch once, and its embeddings are repeated for the
+    questions of each image, which the text encoder and decoder answer together. This is the same as
+    calling the model with a copy of the image for each question, like the notebook does.
+
+    """
+
+    def __init__(self, model_url, image_size=480, device=None, blip_path=None):
+        """Load the model.
+
+        Args:
+            model_url (str): URL or path of the weights of the VQA model.
+            image_size (int): size of the square images the model is given.
+            device (str): torch device, 'cuda' if it is available by default.
+            blip_path (str): path of the BLIP repository, if it is not in the Python path.
+        """
+        import torch
+        from torchvision import transforms
+        from torchvision.transforms.functional import InterpolationMode
+        if blip_path is not None:
+            sys.path.insert(0, blip_path)
+        from models.blip_vqa import blip_vqa
+
+        self.torch = torch
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.transform = transforms.Compose([
+            transforms.Resize((image_size, image_size), interpolation=InterpolationMode.BICUBIC),
+            transforms.ToTensor(),
+            transforms.Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711))
+        ])
+        self.model = blip_vqa(pretrained=model_url, image_size=image_size, vit='base')
+        self.model.eval()
+        self.model = self.model.to(self.device)
+
+    def preprocess(self, images):
+        """Resize and normalize a batch of images.
+
+        Args:
+            images (list): RGB images.
+
+        Returns:
+            torch.Tensor: [images, 3, image_size, image_size] tensor in the device of the model.
+        """
+        return self.torch.stack([self.transform(image) for image in images]).to(self.device)
+
+    def answer(self, images, index, questions):
+        """Answer the questions of a batch of images, encoding each image once.
+
+        Args:
+            images (torch.Tensor): preprocessed images of the batch.
+            index (numpy.ndarray): position in the batch of the image of each question.
+            questions (list): questions to answer.
+
+        Returns:
+            list: answer of each question.
+        """
+        torch, model = self.torch, self.model
+        with torch.no_grad():
+            image_embeds = model.visual_encoder(images)
+            image_embeds = image_embeds[torch.as_tensor(index, device=self.device)]
+            image_atts = torch.ones(image_embeds.size()[:-1], dtype=torch.long, device=self.device)
+
+            # Same as the 'generate' inference of BLIP, from the image embeddings
+            question = model.tokenizer(questions, padding='longest', truncation=True, max_length=35,
+                                       return_tensors="pt").to(self.device)
+            question.input_ids[:, 0] = model.tokenizer.enc_token_id
+            question_output = model.text_encoder(question.input_ids, attention_mask=question.attention_mask,
+                                                 encoder_hidden_states=image_embeds,
+                                                 encoder_attention_mask=image_atts, return_dict=True)
+            num_beams = 3
+            question_states = question_output.last_hidden_state.repeat_interleave(num_beams, dim=0)
+            question_atts = torch.ones(question_states.size()[:-1], dtype=torch.long, device=self.device)
+            bos_ids = torch.full((len(questions), 1), fill_value=model.tokenizer.bos_token_id,
+                                 device=self.device)
+            outputs = model.text_decoder.generate(input_ids=bos_ids, max_length=10, min_length=1,
+                                                  num_beams=num_beams, eos_token_id=model.tokenizer.sep_token_id,
+                                                  pad_token_id=model.tokenizer.pad_token_id,
+                                                  encoder_hidden_states=question_states,
+                                                  encoder_attention_mask=question_atts)
+        return [model.tokenizer.decode(output, skip_special_tokens=True) for output in outputs]
+
+
+def load_model(args):
+    """Create the model of the arguments.
+
+    Args:
+        args: parsed arguments.
+
+    Returns:
+        model with 'preprocess' and 'answer' methods.
+    """
+    if args.model == 'dummy':
+        return DummyModel()
+    return BlipModel(args.model_url, args.image_size, args.device, args.blip_path)
+
+
+def read_questions(filename):
+    """Read a questions file, in csv, compressed csv or parquet format.
+
+    Args:
+        filename (str): path of the file. It is read as parquet if it ends with '.parquet'.
+
+    Returns:
+        pandas.DataFrame: questions.
+    """
+    if filename.endswith('.parquet'):
+        return pd.read_parquet(filename)
+    return pd.read_csv(filename, dtype=str, keep_default_na=False)
+
+
+def write_questions(questions, filename):
+    """Write a questions file, in the format of its extension like 'read_questions'.
+
+    Args:
+        questions (pandas.DataFrame): questions.
+        filename (str): path of the file. Compressed with gzip if it ends with '.gz'.
+    """
+    if filename.endswith('.parquet'):
+        questions.to_parquet(filename, index=False)
+    else:
+        questions.to_csv(filename, index=False)
+
+
+def image_batches(questions, batch_size):
+    """Group the questions by image, in batches of images.
+
+    Args:
+        questions (pandas.DataFrame): questions, with an image column.
+        batch_size (int): number of images of each batch.
+
+    Yields:
+        tuple: images of the batch, rows of their questions and position in the batch of the image of each row.
+    """
+    groups = questions.groupby('image', sort=False, observed=True).indices
+    images = list(groups)
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        rows = [groups[image] for image in batch]
+        index = np.repeat(np.arange(len(batch)), [len(image_rows) for image_rows in rows])
+        yield batch, np.concatenate(rows), index
+
+
+def answer_questions(model, questions, image_path, batch_size=16, total=None, white_background=False):
+    """Answer the questions of a table with a model, one pass for each batch of images.
+
+    Images of the next batch are loaded by a thread while the model answers the questions of the current one.
+
+    Args:
+        model: model with 'preprocess' and 'answer' methods.
+        questions (pandas.DataFrame): questions, with question and image columns.
+        image_path (str): path of the images.
+        batch_size (int): number of images answered at once.
+        total (int): number of images, for the progress bar.
+        white_background (bool): draw transparent images over a white background.
+
+    Returns:
+        numpy.ndarray: answer of each row of the table.
+    """
+    answers = np.empty(len(questions), dtype=object)
+    texts = questions['question'].to_numpy()
+
+    def load(batch):
+        return [load_image(os.path.join(image_path, image), white_background) for image in batch]
+
+    with ThreadPoolExecutor(max_workers=1) as executor, tqdm(total=total) as progress:
+        batches = image_batches(questions, batch_size)
+        current = next(batches, None)
+        loading = executor.submit(load, current[0]) if current is not None else None
+        while current is not None:
+            batch, rows, index = current
+            images = loading.result()
+            current = next(batches, None)
+            if current is not None:
+                loading = executor.submit(load, current[0])
+
+            answers[rows] = model.answer(model.preprocess(images), index, list(texts[rows]))
+            progress.update(len(batch))
+    return answers
+
+
+def word2int(word):
+    """Compare answers in words as the numbers of the correct answers.
+
+    Args:
+        word (str): answer.
+
+    Returns:
+        str: number of the answer, or the answer if it has none.
+    """
+    return WORD2INT.get(word, word)
+
+
+def accuracy(questions):
+    """Accuracy of the answers of a table.
+
+    Args:
+        questions (pandas.DataFrame): questions, with correct and answer columns.
+
+    Returns:
+        float: percentage of correct answers.
+    """
+    correct = questions['correct'].astype(str).map(word2int)
+    answers = questions['answer'].astype(str).map(word2int)
+    return 100 * (correct == answers).mean()
+
+
+def parse_arguments():
+    """Parse command line arguments.
+
+    Returns:
+        args: parsed arguments.
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--tasks",
+        type=str,
+        nargs='+',
+        default=TASKS,
+        choices=TASKS,
+        help="Tasks to evaluate.",
+    )
+
+    parser.add_argument(
+        "--data_path",
+        type=str,
+        default='.',
+        help="Path with a directory for each task, with the images directory and questions file of the task.",
+    )
+
+    parser.add_argument(
+        "--filename",
+        type=str,
+        default='questions.csv',
+        help="Name of the questions file of each task. Read as parquet if it ends with .parquet.",
+    )
+
+    parser.add_argument(
+        "--output_filename",
+        type=str,
+        default=None,
+        help="Name of the file of each task where the questions are saved with their answers. "
+             "The questions file by default.",
+    )
+
+    parser.add_argument(
+        "--model",
+        type=str,
+        default='blip',
+        choices=['blip', 'dummy'],
+        help="Model that answers the questions. 'blip' needs torch, torchvision and the BLIP repository, "
+             "'dummy' answers a digit without any dependency.",
+    )
+
+    parser.add_argument(
+        "--model_url",
+        type=str,
+        default='https://storage.googleapis.com/sfr-vision-language-research/BLIP/models/model*_vqa.pth',
+        help="URL or path of the weights of the BLIP model.",
+    )
+
+    parser.add_argument(
+        "--blip_path",
+        type=str,
+        default=None,
+        help="Path of the BLIP repository, if it is not the working directory.",
+    )
+
+    parser.add_argument(
+        "--image_size",
+        type=int,
+        default=480,
+        help="Size of the images given to the BLIP model.",
+    )
+
+    parser.add_argument(
+        "--device",
+        type=str,
+        default=None,
+        help="Torch device of the BLIP model, 'cuda' if it is available by default.",
+    )
+
+    parser.add_argument(
+        "--white_background",
+        action='store_true',
+        help="Draw transparent images over a white background. Maze walls are lost on the black background "
+             "of a plain conversion to RGB, like in the notebook, so this changes the accuracy of the maze.",
+    )
+
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=16,
+        help="Number of images whose questions are answered at once.",
+    )
+
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        args.batch_size = 1
+        print("WARNING: Batches need at least one image! Lower values have been set to 1.")
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+    model = load_model(args)
+
+    for task in args.tasks:
+        path = os.path.join(args.data_path, task)
+        questions = read_questions(os.path.join(path, args.filename))
+        images = questions['image'].nunique()
+        print(f"{task.capitalize()}: {len(questions)} questions of {images} images")
+
+        questions['answer'] = answer_questions(model, questions, os.path.join(path, 'images'), args.batch_size,
+                                               images, args.white_background)
+        write_questions(questions, os.path.join(path, args.output_filename or args.filename))
+        print(f"{task.capitalize()} accuracy: {accuracy(questions):.2f}%")
+
+
+if __name__ == '__main__':
+    main()
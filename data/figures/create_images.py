@@ -1,10 +1,31 @@
 """This module generate figure images"""
+import functools
+import json
+import math
+import os
 import random
+import sys
 import argparse
-from PIL import Image, ImageDraw
+from PIL import Image, ImageColor, ImageDraw
 import numpy as np
 from tqdm import tqdm
 
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.image_writer import IMAGE_FORMATS, ImageWriter, fetch_image, image_path, save_image, use_writer
+from common.question_files import manifest_entries
+from common.render_cache import RenderCache, scene_key
+
+FIGURES = ['triangle', 'square', 'circle']
+COLORS = ['red', 'green', 'blue']
+CANVAS = (600, 400)
+# RGBA color of the background and of each figure and color pair, in the order of the figure matrix
+PALETTE = np.array([(255, 255, 255, 255)] + [ImageColor.getrgb(color) + (255,) for _ in FIGURES for color in COLORS],
+                   dtype=np.uint8)
+
 
 def draw_figure(draw, figure, color, x, y, r):
     """Draw a figure with given color, position and radius.
@@ -46,49 +67,235 @@ def figure_name(figure_matrix, x_len, y_len):
     return name + ".png"
 
 
-def create_image(output_path, x_len, y_len, r):
-    """Create an image of figures with given parameters.
+def random_figures(x_len, y_len):
+    """Choose the figure and color of each position at random.
 
     Args:
-        output_path (str): path for output files.
         x_len (int): number of figures in axis X.
         y_len (int): number of figures in axis Y.
-        r (int): radius of figures.
-    """
-    figures = ['triangle', 'square', 'circle']
-    colors = ['red', 'green', 'blue']
-
-    canvas = (600, 400)
-    scale = 1
-    thumb = canvas[0]/scale, canvas[1]/scale
-    image = Image.new('RGBA', canvas, (255, 255, 255, 255))
-    draw = ImageDraw.Draw(image)
 
+    Returns:
+        numpy.ndarray: matrix of figures.
+    """
     # 0 red triangle, 1 green triangle, 2 blue triangle
     # 3 red square, 4 green square, 5 blue square
     # 6 red circle, 7 green circle, 8 blue circle
     figure_matrix = np.zeros((y_len, x_len), dtype=int)
+    for y1 in range(y_len):
+        for x1 in range(x_len):
+            figure = random.randint(0, 2)
+            color = random.randint(0, 2)
+            figure_matrix[y1][x1] = figure * 3 + color
+    return figure_matrix
+
+
+def random_figures_batch(x_len, y_len, batch_size):
+    """Choose the figures of a batch of images at once.
+
+    Figure and color are chosen uniformly, so their code is uniform between 0 and 8 like in
+    'random_figures'.
+
+    Args:
+        x_len (int): number of figures in axis X.
+        y_len (int): number of figures in axis Y.
+        batch_size (int): number of images.
 
-    x_step = thumb[0]/(x_len+1)
-    y_step = thumb[1]/(y_len+1)
+    Returns:
+        numpy.ndarray: [batch_size, y_len, x_len] matrices of figures.
+    """
+    return np.random.randint(0, 9, size=(batch_size, y_len, x_len))
+
+
+def figure_positions(figure_matrix):
+    """Compute the centers of the figures, evenly spaced in the canvas.
+
+    Args:
+        figure_matrix (numpy.ndarray): matrix of figures.
 
+    Yields:
+        tuple: figure, color, x and y position of each figure, in drawing order.
+    """
+    y_len, x_len = figure_matrix.shape
+    x_step = CANVAS[0]/(x_len+1)
+    y_step = CANVAS[1]/(y_len+1)
     for y1 in range(1, y_len + 1):
         for x1 in range(1, x_len + 1):
-            x = x1 * x_step
-            y = y1 * y_step
-            figure = random.randint(0, 2)
-            color = random.randint(0, 2)
-            draw_figure(draw, figures[figure], colors[color], x, y, r)
-            figure_matrix[y1-1][x1-1] = figure * 3 + color
+            figure, color = divmod(int(figure_matrix[y1-1][x1-1]), 3)
+            yield figure, color, x1 * x_step, y1 * y_step
+
+
+def draw_figures_pil(figure_matrix, r, filename):
+    """Draw the figures one by one with ImageDraw and save the image.
+
+    Args:
+        figure_matrix (numpy.ndarray): matrix of figures.
+        r (int): radius of figures.
+        filename (str): path of the PNG file.
+    """
+    image = Image.new('RGBA', CANVAS, (255, 255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for figure, color, x, y in figure_positions(figure_matrix):
+        draw_figure(draw, FIGURES[figure], COLORS[color], x, y, r)
+    save_image(image, filename)
+
+
+@functools.lru_cache(maxsize=None)
+def figure_sprite(figure, r, dx, dy):
+    """Rasterize a figure once with ImageDraw, to paste it in every image.
+
+    Positions are not integers, so each sub-pixel offset of the center has its own sprite. Figures
+    in the same row or column have the same offset, so there are only a few of them.
+
+    Args:
+        figure (int): figure index in FIGURES.
+        r (int): radius.
+        dx (float): offset of the center in axis X, between 0 and 1.
+        dy (float): offset of the center in axis Y, between 0 and 1.
+
+    Returns:
+        numpy.ndarray: boolean mask of the figure, centered in (r+1, r+1).
+    """
+    size = 2 * r + 3
+    mask = Image.new('1', (size, size), 0)
+    draw_figure(ImageDraw.Draw(mask), FIGURES[figure], 1, r + 1 + dx, r + 1 + dy, r)
+    return np.array(mask)
+
+
+def render_labels(figure_matrix, r, labels=None):
+    """Compose the image by pasting the sprites of the figures, as indices of PALETTE.
+
+    Args:
+        figure_matrix (numpy.ndarray): matrix of figures.
+        r (int): radius of figures.
+        labels (numpy.ndarray): [400, 600] array to draw in, filled with zeros. A new one is created
+            if not given.
+
+    Returns:
+        numpy.ndarray: [400, 600] uint8 array, 0 for the background and 1 + figure * 3 + color for figures.
+    """
+    width, height = CANVAS
+    if labels is None:
+        labels = np.zeros((height, width), dtype=np.uint8)
+    for figure, color, x, y in figure_positions(figure_matrix):
+        col, row = math.floor(x), math.floor(y)
+        mask = figure_sprite(figure, r, x - col, y - row)
+        # Large figures can be partly outside of the canvas
+        left, top = col - r - 1, row - r - 1
+        rows = slice(max(top, 0), min(top + mask.shape[0], height))
+        cols = slice(max(left, 0), min(left + mask.shape[1], width))
+        mask = mask[rows.start - top:rows.stop - top, cols.start - left:cols.stop - left]
+        np.copyto(labels[rows, cols], 1 + figure * 3 + color, where=mask)
+    return labels
+
+
+def render_batch(figure_matrices, r):
+    """Compose the images of a batch of figure matrices in a single array.
+
+    Args:
+        figure_matrices (list): matrices of figures.
+        r (int): radius of figures.
+
+    Returns:
+        numpy.ndarray: [batch, 400, 600, 3] RGB images.
+    """
+    width, height = CANVAS
+    labels = np.zeros((len(figure_matrices), height, width), dtype=np.uint8)
+    for i, figure_matrix in enumerate(figure_matrices):
+        render_labels(figure_matrix, r, labels[i])
+    return np.take(PALETTE[:, :3], labels, axis=0)
+
+
+def draw_figures_fast(figure_matrix, r, filename):
+    """Compose the image from sprites and save it.
+
+    Args:
+        figure_matrix (numpy.ndarray): matrix of figures.
+        r (int): radius of figures.
+        filename (str): path of the PNG file.
+    """
+    pixels = np.take(PALETTE, render_labels(figure_matrix, r), axis=0)
+    save_image(Image.fromarray(pixels, 'RGBA'), filename)
+
+
+RENDERERS = {'pil': draw_figures_pil, 'fast': draw_figures_fast}
+
+
+def create_image(output_path, x_len, y_len, r, renderer='pil', figure_matrix=None, render=True):
+    """Create an image of figures with given parameters.
+
+    The image is linked from the render cache instead if it was drawn before with the same renderer.
+    Without render, the image is only named, to write its questions and render it later.
+
+    Args:
+        output_path (str): path for output files.
+        x_len (int): number of figures in axis X.
+        y_len (int): number of figures in axis Y.
+        r (int): radius of figures.
+        renderer (str): name of the renderer.
+        figure_matrix (numpy.ndarray): matrix of figures. Chosen at random if not given.
+        render (bool): draw the image.
+
+    Returns:
+        tuple: figure name and matrix of figures.
+    """
+    if figure_matrix is None:
+        figure_matrix = random_figures(x_len, y_len)
+    filename = image_path(f"{output_path}/{figure_name(figure_matrix, x_len, y_len)}")
+    if render and not fetch_image(filename, scene_key('figures', renderer, figure_matrix, r)):
+        RENDERERS[renderer](figure_matrix, r, filename)
+    return os.path.basename(filename), figure_matrix
+
+
+def manifest_entry(fig_name, figure_matrix, x_len, y_len):
+    """Create the manifest line of an image, with the parameters needed to create its questions.
+
+    Args:
+        fig_name (str): figure name.
+        figure_matrix (numpy.ndarray): matrix of figures.
+        x_len (int): number of figures in axis X.
+        y_len (int): number of figures in axis Y.
+
+    Returns:
+        str: JSON line.
+    """
+    entry = {
+        'image': fig_name,
+        'x_len': x_len,
+        'y_len': y_len,
+        'figures': figure_matrix.tolist(),
+    }
+    return json.dumps(entry) + '\n'
+
+
+def read_manifest_figures(filename):
+    """Read the images of a manifest to render them.
+
+    Args:
+        filename (str): path of the manifest.
+
+    Yields:
+        tuple: matrix of figures and number of figures in axis X and Y.
+    """
+    for entry in manifest_entries(filename):
+        yield np.array(entry['figures'], dtype=int), entry['x_len'], entry['y_len']
+
+
+def report_cache(cache):
+    """Remove the least recently used images of the render cache and print its size.
 
-    image.thumbnail(thumb)
-    fig_name = figure_name(figure_matrix, x_len, y_len)
-    image.save(f"{output_path}/{fig_name}")
+    Args:
+        cache (RenderCache): render cache.
+    """
+    images, size, removed = cache.trim()
+    print(f"Render cache: {images} images ({size / 2**20:.1f} MB), {removed} least recently used removed.")
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     """Parse command line arguments.
 
+    Args:
+        argv (list): arguments to parse instead of the ones of the command line.
+
     Returns:
         args: parsed arguments.
     """
@@ -129,14 +336,131 @@ def parse_arguments():
         help="Path for output files.",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--renderer",
+        type=str,
+        default='pil',
+        choices=['pil', 'fast'],
+        help="Renderer of the images. 'pil' draws each figure with ImageDraw. 'fast' pastes figures "
+             "rasterized only once, with the same result.",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default='manifest.jsonl',
+        help="Name of the manifest in output_path. A JSON line with the parameters of each created image is "
+             "appended to it.",
+    )
+
+    parser.add_argument(
+        "--image_format",
+        type=str,
+        default='png',
+        choices=list(IMAGE_FORMATS),
+        help="Format of the images. 'webp' is lossless.",
+    )
+
+    parser.add_argument(
+        "--compress_level",
+        type=int,
+        default=6,
+        help="Compression level of PNG images, between 0 (fastest) and 9 (smallest).",
+    )
+
+    parser.add_argument(
+        "--palette",
+        action='store_true',
+        help="Save PNG images with at most 256 colors in palette mode, smaller and faster to encode.",
+    )
+
+    parser.add_argument(
+        "--writer_threads",
+        type=int,
+        default=1,
+        help="Number of threads that save the images while the next ones are drawn. With 0, images are "
+             "saved after drawing each one.",
+    )
+
+    parser.add_argument(
+        "--skip_render",
+        action='store_true',
+        help="Only choose the figures and append them to the manifest, without drawing the images. Questions "
+             "can be created from the manifest, and the images drawn later with render_manifest.",
+    )
+
+    parser.add_argument(
+        "--render_manifest",
+        type=str,
+        default=None,
+        help="Draw the images of this manifest in output_path with radius r, like a subset of one created with "
+             "skip_render, instead of choosing new figures.",
+    )
+
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="Directory of the render cache. Images drawn before with the same figures, radius, renderer and "
+             "image options are linked from it instead of drawn again.",
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=1024,
+        help="Maximum size of the render cache in MB. The least recently used images are removed at the end.",
+    )
+
+    return parser.parse_args(argv)
+
+
+def check_args(args):
+    """Check the input values, and correct them with a warning.
+
+    Args:
+        args: parsed arguments.
+
+    Returns:
+        args: corrected arguments.
+    """
+    if args.writer_threads < 0:
+        args.writer_threads = 0
+        print("WARNING: The number of writer threads cannot be negative! Lower values have been set to 0.")
+
+    if not 0 <= args.compress_level <= 9:
+        args.compress_level = min(max(args.compress_level, 0), 9)
+        print("WARNING: Compression level should be between 0 and 9! It has been set to the nearest one.")
+
+    return args
 
 
 def main():
     """Main function."""
     args = parse_arguments()
-    for _ in tqdm(range(args.n), total=args.n, desc="Images"):
-        create_image(args.output_path, args.x_len, args.y_len, args.r)
+    args = check_args(args)
+    batch_size = 1024
+    cache = RenderCache(args.cache_path, args.cache_size * 2**20) if args.cache_path else None
+    writer = ImageWriter(args.image_format, args.compress_level, args.palette, args.writer_threads, cache=cache)
+    use_writer(writer)
+    if args.render_manifest:
+        # Images of the manifest are only drawn, so nothing is appended to the manifest of output_path
+        images = list(read_manifest_figures(args.render_manifest))
+        with writer:
+            for figure_matrix, x_len, y_len in tqdm(images, desc="Images"):
+                create_image(args.output_path, x_len, y_len, args.r, args.renderer, figure_matrix)
+    else:
+        with open(os.path.join(args.output_path, args.manifest), 'a', encoding='UTF-8') as manifest, \
+                writer, tqdm(total=args.n, desc="Images") as progress:
+            for start in range(0, args.n, batch_size):
+                batch = random_figures_batch(args.x_len, args.y_len, min(batch_size, args.n - start))
+                for figure_matrix in batch:
+                    fig_name, _ = create_image(args.output_path, args.x_len, args.y_len, args.r, args.renderer,
+                                               figure_matrix, not args.skip_render)
+                    manifest.write(manifest_entry(fig_name, figure_matrix, args.x_len, args.y_len))
+                    progress.update()
+    if cache is not None:
+        report_cache(cache)
 
 
 if __name__ == '__main__':
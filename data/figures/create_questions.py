@@ -1,47 +1,97 @@
 """This module generates questions for images."""
 import argparse
-from collections import defaultdict
+import itertools
 import os
-import csv
-import random
+import sys
 import numpy as np
 from tqdm import tqdm
 
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
 
-def write_questions(questions, filename):
-    """Write questions to a csv file.
+from common.question_files import manifest_entries, write_questions
+
+
+FIGURES = ['triangle', 'square', 'circle']
+COLORS = ['red', 'green', 'blue']
+# Questions of each image, in the order of the columns of 'question_table'
+QUESTIONS = (["How many figures?", "How many columns?", "How many rows?"]
+             + [f"How many {figure}s?" for figure in FIGURES]
+             + [f"How many {color} figures?" for color in COLORS]
+             + [f"How many {color} {figure}s?" for figure in FIGURES for color in COLORS])
+
+
+def wrong_answers_batch(correct):
+    """Create wrong answers for an array of correct answers at once.
+
+    Wrong answers are chosen uniformly in a range of the square root of the correct answer around it, at
+    least 2 and without negative values: the first one among the values different from the correct answer,
+    and the second one among the values different from both.
 
     Args:
-        questions (list): list of questions.
-        filename (str): path to the output file.
+        correct (numpy.ndarray): correct answers.
+
+    Returns:
+        tuple: arrays of first and second wrong answers.
     """
-    with open(filename, 'w', encoding='UTF-8', newline="") as csvfile:
-        spamwriter = csv.writer(csvfile, delimiter=',',
-                                quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        spamwriter.writerow(['type', 'question', 'correct',
-                             'wrong1', 'wrong2', 'image'])
-        for question in questions:
-            spamwriter.writerow(question)
+    wrong_var = np.maximum(np.round(np.sqrt(correct)), 2).astype(int)
+    low = np.maximum(correct - wrong_var, 0)
+    # Number of values in the range that are not the correct answer, at least 2
+    size = correct + wrong_var - low
+
+    first = np.random.randint(0, size)
+    second = np.random.randint(0, size - 1)
+    second += second >= first
+
+    # Index among the values different from the correct answer to value
+    skip = correct - low
+    return low + first + (first >= skip), low + second + (second >= skip)
 
 
-def wrong_answers(correct):
-    """Create wrong answers for a given correct answer.
+def figure_counts(figure_matrices):
+    """Count each figure and color pair in a list of figure matrices at once.
+
+    Codes of each matrix are offset by 9 times its index, so a single np.bincount counts them all.
 
     Args:
-        correct (int): correct answer.
+        figure_matrices (list): matrices of figures, of any shape.
 
     Returns:
-        list: list of wrong answers.
+        numpy.ndarray: [matrices, 9] counts of each code.
     """
-    answers = [correct]
-    wrong_var = round((correct) ** 0.5)
-    wrong_var = max(wrong_var, 2)
-    while len(answers) < 3:
-        wrong = random.randint(
-            max(correct - wrong_var, 0), correct + wrong_var)
-        if wrong not in answers:
-            answers.append(wrong)
-    return answers[1], answers[2]
+    sizes = [figure_matrix.size for figure_matrix in figure_matrices]
+    codes = np.concatenate([figure_matrix.ravel() for figure_matrix in figure_matrices])
+    codes += np.repeat(9 * np.arange(len(figure_matrices)), sizes)
+    return np.bincount(codes, minlength=9 * len(figure_matrices)).reshape(-1, 9)
+
+
+def question_table(images):
+    """Create the questions of a list of images at once, as columns.
+
+    Args:
+        images (list): image filename, figures matrix and lengths of the x and y axes of each image.
+
+    Returns:
+        dict: type, question, correct, wrong1, wrong2 and image columns, with the questions of
+            each image in the order of QUESTIONS.
+    """
+    names, figure_matrices, x_len, y_len = zip(*images)
+    x_len, y_len = np.array(x_len), np.array(y_len)
+    counts = figure_counts(figure_matrices)
+    pairs = counts.reshape(-1, 3, 3)
+
+    correct = np.column_stack([x_len * y_len, x_len, y_len, pairs.sum(axis=2), pairs.sum(axis=1), counts])
+    wrong1, wrong2 = wrong_answers_batch(correct)
+    return {
+        'type': ["Figures"] * correct.size,
+        'question': QUESTIONS * len(names),
+        'correct': correct.ravel().tolist(),
+        'wrong1': wrong1.ravel().tolist(),
+        'wrong2': wrong2.ravel().tolist(),
+        'image': np.repeat(names, len(QUESTIONS)).tolist(),
+    }
 
 
 def parse_filename(filename):
@@ -68,73 +118,62 @@ def parse_filename(filename):
     return figure_matrix, x_len, y_len
 
 
-def create_questions(image_path):
+def list_images(image_path):
+    """List the images in a directory, parsing their filenames.
+
+    Args:
+        image_path (str): path to the directory with images.
+
+    Yields:
+        tuple: image filename, figures matrix and lengths of the x and y axes.
+    """
+    for image in os.listdir(image_path):
+        if os.path.splitext(image)[1] in ('.png', '.webp'):
+            yield (image, *parse_filename(image))
+
+
+def read_manifest(filename):
+    """Read the images of a manifest created by create_images.py, one line at a time.
+
+    Args:
+        filename (str): path to the manifest.
+
+    Yields:
+        tuple: image filename, figures matrix and lengths of the x and y axes.
+    """
+    for entry in manifest_entries(filename):
+        figure_matrix = np.array(entry['figures'], dtype=int)
+        yield entry['image'], figure_matrix, entry['x_len'], entry['y_len']
+
+
+def create_questions(image_path, manifest=None, chunk_size=10000):
     """Create questions for each image in the images_path directory.
 
     18 questions are created for each image. 3 questions about figure, column and row count.
     3 questions about figure shape. 3 questions about figure color. 
     9 questions about figure shape and color.
 
+    Questions are created in chunks of chunk_size images, with 'question_table'.
+
     Args:
         image_path (str): path to the directory with images.
+        manifest (str): path to the manifest created by create_images.py. If not given,
+            images are parsed from the filenames in image_path.
+        chunk_size (int): number of images whose questions are created at once.
 
-    Returns:
-        list: list of questions.
+    Yields:
+        tuple: question, answers and image filename.
     """
-    figures = ['triangle', 'square', 'circle']
-    colors = ['red', 'green', 'blue']
-    category = "Figures"
-    images = os.listdir(image_path)
-    questions = []
-
-    for image in tqdm(images, desc='Questions', total=len(images)):
-        figure_matrix, x_len, y_len = parse_filename(image)
-
-        question = "How many figures?"
-        correct = x_len * y_len
-        wrong1, wrong2 = wrong_answers(correct)
-        questions.append([category, question, correct,
-                          wrong1, wrong2, image])
-
-        question = "How many columns?"
-        correct = x_len
-        wrong1, wrong2 = wrong_answers(correct)
-        questions.append([category, question, correct,
-                          wrong1, wrong2, image])
-
-        question = "How many rows?"
-        correct = y_len
-        wrong1, wrong2 = wrong_answers(correct)
-        questions.append([category, question, correct,
-                          wrong1, wrong2, image])
-
-        unique, count = np.unique(figure_matrix, return_counts=True)
-        counts = dict(zip(unique, count))
-        counts = defaultdict(int, counts)
-
-        for i, figure in enumerate(figures):
-            question = f"How many {figure}s?"
-            correct = counts[i * 3] + counts[i * 3 + 1] + counts[i * 3 + 2]
-            wrong1, wrong2 = wrong_answers(correct)
-            questions.append([category, question, correct,
-                              wrong1, wrong2, image])
-
-        for i, color in enumerate(colors):
-            question = f"How many {color} figures?"
-            correct = counts[i] + counts[i + 3] + counts[i + 6]
-            wrong1, wrong2 = wrong_answers(correct)
-            questions.append([category, question, correct,
-                              wrong1, wrong2, image])
-
-        for i, figure in enumerate(figures):
-            for j, color in enumerate(colors):
-                question = f"How many {color} {figure}s?"
-                correct = counts[i * 3 + j]
-                wrong1, wrong2 = wrong_answers(correct)
-                questions.append(
-                    [category, question, correct, wrong1, wrong2, image])
-
-    return questions
+    images = read_manifest(manifest) if manifest else list_images(image_path)
+
+    with tqdm(desc='Questions') as progress:
+        while True:
+            chunk = list(itertools.islice(images, chunk_size))
+            if not chunk:
+                break
+
+            yield from zip(*question_table(chunk).values())
+            progress.update(len(chunk))
 
 
 def parse_arguments():
@@ -152,11 +191,27 @@ def parse_arguments():
         help="Path for input images.",
     )
 
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="Manifest created by create_images.py. If not given, images are parsed from the filenames in "
+             "image_path.",
+    )
+
     parser.add_argument(
         "--filename",
         type=str,
         default='questions.csv',
-        help="Path for output file.",
+        help="Path for output file. Compressed with gzip if it ends with .gz.",
+    )
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        default='csv',
+        choices=['csv', 'parquet'],
+        help="Format of the output file. 'parquet' needs pyarrow.",
     )
 
     return parser.parse_args()
@@ -165,8 +220,8 @@ def parse_arguments():
 def main():
     """Main function."""
     args = parse_arguments()
-    questions = create_questions(args.image_path)
-    write_questions(questions, args.filename)
+    questions = create_questions(args.image_path, args.manifest)
+    write_questions(questions, args.filename, args.format)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,106 @@
+"""This module draws figure images and creates their questions when they are used, as a dataset without files."""
+import os
+import random
+import sys
+
+import numpy as np
+
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.datasets import kept_random_state, to_rgb
+from common.image_writer import capture_images
+from create_images import RENDERERS, figure_name, random_figures_batch
+from create_questions import QUESTIONS, question_table
+
+
+class FiguresDataset:
+    """Questions of n images of random figures, drawn in memory when they are used.
+
+    Image i is chosen from the seed and i, so every item is the same in any process, and the dataset can
+    be read by several workers, like the ones of a PyTorch DataLoader. Each item is an
+    (image, question, correct, wrong1, wrong2) tuple, where image is a [400, 600, 3] uint8 array.
+    Questions of an image are consecutive items, and the last image is kept, so each image is drawn
+    only once when items are read in order. Images are converted to RGB like 'evaluate.py' does, over a
+    white background with white_background.
+
+    """
+
+    def __init__(self, n, x_len=6, y_len=4, r=32, renderer='fast', seed=0, white_background=False):
+        """Create the dataset. No image is drawn until it is used.
+
+        Args:
+            n (int): number of images.
+            x_len (int): number of figures in axis X.
+            y_len (int): number of figures in axis Y.
+            r (int): radius of figures.
+            renderer (str): name of the renderer.
+            seed (int): random seed of the dataset.
+            white_background (bool): draw the images over a white background where they are transparent.
+        """
+        self.n = n
+        self.x_len, self.y_len = x_len, y_len
+        self.r = r
+        self.renderer = renderer
+        self.seed = seed
+        self.white_background = white_background
+        self.questions_per_image = len(QUESTIONS)
+        self.last = None
+
+    def __len__(self):
+        return self.n * self.questions_per_image
+
+    def image(self, i):
+        """Choose the figures of image i, draw it and create its questions.
+
+        Args:
+            i (int): index of the image.
+
+        Returns:
+            tuple: [400, 600, 3] image array and list of (question, correct, wrong1, wrong2) tuples.
+        """
+        if self.last is not None and self.last[0] == i:
+            return self.last[1]
+
+        with kept_random_state():
+            random.seed(f"{self.seed}_{i}")
+            np.random.seed(random.randrange(2**32))
+            figure_matrix = random_figures_batch(self.x_len, self.y_len, 1)[0]
+
+            name = figure_name(figure_matrix, self.x_len, self.y_len)
+            with capture_images() as images:
+                RENDERERS[self.renderer](figure_matrix, self.r, name)
+            image = to_rgb(images[name], self.white_background)
+
+            table = question_table([(name, figure_matrix, self.x_len, self.y_len)])
+            questions = list(zip(table['question'], table['correct'], table['wrong1'], table['wrong2']))
+        self.last = (i, (image, questions))
+        return image, questions
+
+    def __getitem__(self, index):
+        """Get a question of an image, drawing the image if it is not the last one.
+
+        Args:
+            index (int): index of the question. Questions of image i start at i * questions_per_image.
+
+        Returns:
+            tuple: image, question, correct, wrong1 and wrong2.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Question index out of range")
+
+        i, question = divmod(index, self.questions_per_image)
+        image, questions = self.image(i)
+        return (image, *questions[question])
+
+    def __iter__(self):
+        """Draw each image once and yield its questions."""
+
+        for i in range(self.n):
+            image, questions = self.image(i)
+            for question in questions:
+                yield (image, *question)
@@ -0,0 +1,110 @@
+"""This module compares the speed and the output of the maze renderers against cairosvg."""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from create_images import RENDERERS, Maze
+from fast_renderer import render_maze
+
+
+def pixel_diff(path_a, path_b):
+    """Compare two images pixel by pixel.
+
+    Args:
+        path_a (str): path of the first image.
+        path_b (str): path of the second image.
+
+    Returns:
+        tuple: largest absolute difference (0-255) and fraction of pixels that differ.
+    """
+    image_a = np.asarray(Image.open(path_a).convert('RGBA'), dtype=int)
+    image_b = np.asarray(Image.open(path_b).convert('RGBA'), dtype=int)
+    diff = np.abs(image_a - image_b)
+    return diff.max(), (diff.max(axis=2) > 0).mean()
+
+
+def parse_arguments():
+    """Parse command line arguments.
+
+    Returns:
+        args: parsed arguments.
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--nx",
+        type=int,
+        default=12,
+        help="Number of cells in axis X.",
+    )
+
+    parser.add_argument(
+        "--ny",
+        type=int,
+        default=8,
+        help="Number of cells in axis Y.",
+    )
+
+    parser.add_argument(
+        "--n",
+        type=int,
+        default=50,
+        help="Number of compared images.",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed.",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+    args = parse_arguments()
+    random.seed(args.seed)
+
+    times = {name: 0.0 for name in RENDERERS}
+    # Writing the PNG file takes a good part of the fast renderer time, so drawing alone is also measured
+    render_time = 0.0
+    diffs = {name: [] for name in RENDERERS if name != 'svg'}
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in tqdm(range(args.n), total=args.n, desc="Images"):
+            maze = Maze(args.nx, args.ny)
+            maze.make_maze()
+            paths = {name: os.path.join(tmp, f"{name}_{i}.png") for name in times}
+
+            start = time.perf_counter()
+            render_maze(maze)
+            render_time += time.perf_counter() - start
+
+            for name, draw in RENDERERS.items():
+                start = time.perf_counter()
+                draw(maze, paths[name])
+                times[name] += time.perf_counter() - start
+
+            for name, diff in diffs.items():
+                diff.append(pixel_diff(paths['svg'], paths[name]))
+
+    for name, total in times.items():
+        print(f"{name}: {1000 * total / args.n:.1f} ms per image, {args.n / total:.0f} images per second, "
+              f"{times['svg'] / total:.1f}x")
+    print(f"fast without writing the PNG: {1000 * render_time / args.n:.1f} ms per image, "
+          f"{times['svg'] / render_time:.1f}x")
+    for name, diff in diffs.items():
+        diff = np.array(diff)
+        print(f"{name}: largest pixel difference {diff[:, 0].max()} / 255, "
+              f"{100 * diff[:, 1].mean():.3f}% of pixels differ")
+
+
+if __name__ == '__main__':
+    main()
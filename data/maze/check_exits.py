@@ -0,0 +1,76 @@
+"""This module checks the exits in the filenames of maze images with the path solver of 'Maze'."""
+import argparse
+import os
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from create_images import Maze
+from create_questions import list_images
+
+
+def read_maze(path, nx, ny):
+    """Recover the walls of a maze from its image.
+
+    Walls are drawn on the lines between cells, so a passage is open if the middle of its line is not
+    fully opaque.
+
+    Args:
+        path (str): path of the image.
+        nx (int): number of cells in axis x.
+        ny (int): number of cells in axis y.
+
+    Returns:
+        Maze: maze with the walls of the image.
+    """
+    alpha = np.asarray(Image.open(path).convert('RGBA'))[..., 3]
+    maze = Maze(nx, ny)
+    width, height = maze.image_size()
+    scx, scy = width / nx, height / ny
+    for x in range(nx):
+        for y in range(ny):
+            if y < ny-1 and alpha[int((y+1)*scy), int((x+0.5)*scx)] < 255:
+                maze.knock_down_wall(x, y, 'S')
+            if x < nx-1 and alpha[int((y+0.5)*scy), int((x+1)*scx)] < 255:
+                maze.knock_down_wall(x, y, 'E')
+    return maze
+
+
+def parse_arguments():
+    """Parse command line arguments.
+
+    Returns:
+        args: parsed arguments.
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--image_path",
+        type=str,
+        default="images",
+        help="Path to the directory with images.",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+    args = parse_arguments()
+
+    wrong = []
+    images = sorted(list_images(args.image_path))
+    for image, nx, ny, _, end, _ in tqdm(images, desc="Images"):
+        maze = read_maze(os.path.join(args.image_path, image), nx, ny)
+        exits = maze.reachable_exits([0, 0])
+        if exits != [end]:
+            wrong.append((image, exits))
+
+    for image, exits in wrong:
+        print(f"{image}: reachable exits {exits}")
+    print(f"{len(images) - len(wrong)} of {len(images)} images have the exit of their filename")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,91 @@
 """This module creates maze images"""
+import base64
+import io
+import json
 import os
 import random
+import sys
 import argparse
-from cairosvg import svg2png
+from collections.abc import MutableMapping
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+from PIL import Image
 from tqdm import tqdm
 
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.image_writer import IMAGE_FORMATS, ImageWriter, fetch_image, image_path, save_image, use_writer
+from common.question_files import manifest_entries
+from common.render_cache import RenderCache, scene_key
+from fast_renderer import draw_maze_fast
+
 # Create a maze using the depth-first algorithm described at
 # https://scipython.com/blog/making-a-maze/
 # Christian Hill, April 2017.
 
 
+# Bit of each wall in the walls array of a maze, and the wall on the other side of it
+WALL_BITS = {'N': 1, 'S': 2, 'E': 4, 'W': 8}
+ALL_WALLS = 15
+WALL_PAIRS = {'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E'}
+# Cell offset in each direction
+DELTAS = {'W': (-1, 0), 'E': (1, 0), 'S': (0, 1), 'N': (0, -1)}
+
+
+class Walls(MutableMapping):
+    """The walls of a cell, as a dictionary view of its bits in the walls array."""
+
+    def __init__(self, walls, x, y):
+        """Initialize the view of the walls of the cell at (x,y) in the walls array."""
+
+        self.walls, self.x, self.y = walls, x, y
+
+    def __getitem__(self, wall):
+        return bool(self.walls[self.x, self.y] & WALL_BITS[wall])
+
+    def __setitem__(self, wall, value):
+        if value:
+            self.walls[self.x, self.y] |= WALL_BITS[wall]
+        else:
+            self.walls[self.x, self.y] &= ALL_WALLS ^ WALL_BITS[wall]
+
+    def __delitem__(self, wall):
+        raise TypeError("Walls of a cell cannot be removed, only knocked down.")
+
+    def __iter__(self):
+        return iter(WALL_BITS)
+
+    def __len__(self):
+        return len(WALL_BITS)
+
+
 class Cell:
     """A cell in the maze.
 
     A maze "Cell" is a point in the grid which may be surrounded by walls to
-    the north, east, south or west.
+    the north, east, south or west. Walls are stored as bits in the array of
+    the maze, so a cell is only a view of its position in that array.
 
     """
 
     # A wall separates a pair of cells in the N-S or W-E directions.
-    wall_pairs = {'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E'}
+    wall_pairs = WALL_PAIRS
+
+    def __init__(self, x, y, walls=None):
+        """Initialize the cell at (x,y). At first it is surrounded by walls.
 
-    def __init__(self, x, y):
-        """Initialize the cell at (x,y). At first it is surrounded by walls."""
+        If the walls array of a maze is given, the cell is a view of its walls in it.
+
+        """
 
         self.x, self.y = x, y
-        self.walls = {'N': True, 'S': True, 'E': True, 'W': True}
+        if walls is None:
+            walls, x, y = np.full((1, 1), ALL_WALLS, dtype=np.uint8), 0, 0
+        self.walls = Walls(walls, x, y)
 
     def has_all_walls(self):
         """Does this cell still have all its walls?"""
@@ -46,7 +106,13 @@ class Cell:
 
 
 class Maze:
-    """A Maze, represented as a grid of cells."""
+    """A Maze, represented as a grid of cells.
+
+    The walls of each cell are the bits of a [nx, ny] uint8 array, see WALL_BITS.
+    Loops go through a memoryview of the array, which is much faster than indexing
+    NumPy arrays one element at a time.
+
+    """
 
     def __init__(self, nx, ny, ix=0, iy=0):
         """Initialize the maze grid.
@@ -57,12 +123,31 @@ class Maze:
 
         self.nx, self.ny = nx, ny
         self.ix, self.iy = ix, iy
-        self.maze_map = [[Cell(x, y) for y in range(ny)] for x in range(nx)]
+        self.walls = np.full((nx, ny), ALL_WALLS, dtype=np.uint8)
+
+    @property
+    def maze_map(self):
+        """Grid of Cell views of the walls array."""
+
+        return [[self.cell_at(x, y) for y in range(self.ny)] for x in range(self.nx)]
 
     def cell_at(self, x, y):
         """Return the Cell object at (x,y)."""
 
-        return self.maze_map[x][y]
+        return Cell(x, y, self.walls)
+
+    def has_wall(self, x, y, wall):
+        """Is there a wall in the given direction of the cell at (x,y)?"""
+
+        return bool(memoryview(self.walls)[x, y] & WALL_BITS[wall])
+
+    def knock_down_wall(self, x, y, wall, walls=None):
+        """Knock down the wall in the given direction of the cell at (x,y), on both sides."""
+
+        walls = memoryview(self.walls) if walls is None else walls
+        dx, dy = DELTAS[wall]
+        walls[x, y] &= ALL_WALLS ^ WALL_BITS[wall]
+        walls[x + dx, y + dy] &= ALL_WALLS ^ WALL_BITS[WALL_PAIRS[wall]]
 
     def __str__(self):
         """Return a (crude) string representation of the maze."""
@@ -71,36 +156,100 @@ class Maze:
         for y in range(self.ny):
             maze_row = ['|']
             for x in range(self.nx):
-                if self.maze_map[x][y].walls['E']:
+                if self.has_wall(x, y, 'E'):
                     maze_row.append(' |')
                 else:
                     maze_row.append('  ')
             maze_rows.append(''.join(maze_row))
             maze_row = ['|']
             for x in range(self.nx):
-                if self.maze_map[x][y].walls['S']:
+                if self.has_wall(x, y, 'S'):
                     maze_row.append('-+')
                 else:
                     maze_row.append(' +')
             maze_rows.append(''.join(maze_row))
         return '\n'.join(maze_rows)
 
-    def write_svg(self, filename):
-        """Write an SVG image of the maze to filename."""
+    def image_size(self):
+        """Return the width and height of the maze image, in pixels."""
 
         aspect_ratio = self.nx / self.ny
+        height = 400
+        width = int(height * aspect_ratio)
+        return width, height
+
+    def pack_walls(self):
+        """Pack the walls of the maze in a base64 string, to save them in the manifest.
+
+        Only the South and East walls of each cell are saved, 2 bits per cell, because the North and West
+        walls are the South and East walls of the neighbouring cells or the border.
+
+        Returns:
+            str: base64 string of the [2, nx, ny] South and East wall bits.
+        """
+        bits = np.stack([self.walls & WALL_BITS['S'], self.walls & WALL_BITS['E']]) > 0
+        return base64.b64encode(np.packbits(bits)).decode('ascii')
+
+    @classmethod
+    def unpack_walls(cls, nx, ny, walls):
+        """Create a maze with the walls packed by 'pack_walls'.
+
+        North and West walls are the South and East walls of the neighbouring cells, or the border.
+
+        Args:
+            nx (int): number of cells in axis x.
+            ny (int): number of cells in axis y.
+            walls (str): base64 string of the [2, nx, ny] South and East wall bits.
+
+        Returns:
+            Maze: maze with the same walls.
+        """
+        bits = np.unpackbits(np.frombuffer(base64.b64decode(walls), dtype=np.uint8), count=2 * nx * ny)
+        south, east = bits.reshape(2, nx, ny)
+        north = np.ones_like(south)
+        north[:, 1:] = south[:, :-1]
+        west = np.ones_like(east)
+        west[1:, :] = east[:-1, :]
+
+        maze = cls(nx, ny)
+        maze.walls = (south * WALL_BITS['S'] | east * WALL_BITS['E']
+                      | north * WALL_BITS['N'] | west * WALL_BITS['W']).astype(np.uint8)
+        return maze
+
+    def wall_lines(self):
+        """Return the (x1, y1, x2, y2) lines of the maze walls in image coordinates."""
+
+        width, height = self.image_size()
+        # Scaling factors mapping maze coordinates to image coordinates
+        scy, scx = height / self.ny, width / self.nx
+
+        lines = []
+        # The "South" and "East" walls of each cell, if present (these
+        # are the "North" and "West" walls of a neighbouring cell in
+        # general, of course), sorted by cell.
+        drawn = np.stack([self.walls & WALL_BITS['S'], self.walls & WALL_BITS['E']], axis=2)
+        for x, y, east in zip(*(index.tolist() for index in np.nonzero(drawn))):
+            if east:
+                lines.append(((x+1)*scx, y*scy, (x+1)*scx, (y+1)*scy))
+            else:
+                lines.append((x*scx, (y+1)*scy, (x+1)*scx, (y+1)*scy))
+        # The North and West maze border, which won't have been drawn
+        # by the procedure above.
+        lines.append((0, 0, width, 0))
+        lines.append((0, 0, 0, height))
+        return lines
+
+    def svg(self):
+        """Return an SVG image of the maze."""
+
         # Pad the maze all around by this amount.
         padding = 0
         # Height and width of the maze image (excluding padding), in pixels
-        height = 400
-        width = int(height * aspect_ratio)
+        width, height = self.image_size()
         height_pad = height + 2 * padding
         width_pad = width + 2 * padding
-        # Scaling factors mapping maze coordinates to image coordinates
-        scy, scx = height / self.ny, width / self.nx
 
-        # Write the SVG image file for maze
-        with open(filename, 'w', encoding='UTF-8') as f:
+        with io.StringIO() as f:
             # SVG preamble and styles.
             print('<?xml version="1.0" encoding="utf-8"?>', file=f)
             print('<svg xmlns="http://www.w3.org/2000/svg"', file=f)
@@ -111,21 +260,8 @@ class Maze:
             print('	stroke: #000000;\n	stroke-linecap: square;', file=f)
             print('	stroke-width: 5;\n}', file=f)
             print(']]></style>\n</defs>', file=f)
-            # Draw the "South" and "East" walls of each cell, if present (these
-            # are the "North" and "West" walls of a neighbouring cell in
-            # general, of course).
-            for x in range(self.nx):
-                for y in range(self.ny):
-                    if self.cell_at(x, y).walls['S']:
-                        x1, y1, x2, y2 = x*scx, (y+1)*scy, (x+1)*scx, (y+1)*scy
-                        print(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}"/>', file=f)
-                    if self.cell_at(x, y).walls['E']:
-                        x1, y1, x2, y2 = (x+1)*scx, y*scy, (x+1)*scx, (y+1)*scy
-                        print(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}"/>', file=f)
-            # Draw the North and West maze border, which won't have been drawn
-            # by the procedure above.
-            print(f'<line x1="0" y1="0" x2="{width}" y2="0"/>', file=f)
-            print(f'<line x1="0" y1="0" x2="0" y2="{height}"/>', file=f)
+            for x1, y1, x2, y2 in self.wall_lines():
+                print(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}"/>', file=f)
             print(
                 '<circle cx="25" cy="25" r="15" stroke="black" stroke-width="3" fill="green" />', file=f)
             print(
@@ -135,47 +271,202 @@ class Maze:
             print(
                 '<circle cx="575" cy="375" r="15" stroke="black" stroke-width="3" fill="yellow" />', file=f)
             print('</svg>', file=f)
+            return f.getvalue()
 
-    def find_valid_neighbours(self, cell):
-        """Return a list of unvisited neighbours to cell."""
+    def write_svg(self, filename):
+        """Write an SVG image of the maze to filename."""
+
+        with open(filename, 'w', encoding='UTF-8') as f:
+            f.write(self.svg())
+
+    def unvisited_neighbours(self, x, y, walls=None):
+        """Return the (direction, x, y) neighbours of the cell at (x,y) that still have all their walls."""
 
-        delta = [('W', (-1, 0)),
-                 ('E', (1, 0)),
-                 ('S', (0, 1)),
-                 ('N', (0, -1))]
+        walls = memoryview(self.walls) if walls is None else walls
         neighbours = []
-        for direction, (dx, dy) in delta:
-            x2, y2 = cell.x + dx, cell.y + dy
-            if (0 <= x2 < self.nx) and (0 <= y2 < self.ny):
-                neighbour = self.cell_at(x2, y2)
-                if neighbour.has_all_walls():
-                    neighbours.append((direction, neighbour))
+        for direction in ('W', 'E', 'S', 'N'):
+            dx, dy = DELTAS[direction]
+            x2, y2 = x + dx, y + dy
+            if (0 <= x2 < self.nx) and (0 <= y2 < self.ny) and walls[x2, y2] == ALL_WALLS:
+                neighbours.append((direction, x2, y2))
         return neighbours
 
-    def make_maze(self):
+    def find_valid_neighbours(self, cell):
+        """Return a list of unvisited neighbours to cell."""
+
+        return [(direction, self.cell_at(x, y))
+                for direction, x, y in self.unvisited_neighbours(cell.x, cell.y)]
+
+    def make_maze(self, algorithm='dfs'):
+        """Build a maze with one of the algorithms in ALGORITHMS.
+
+        All of them build a spanning tree of the cells, so there is a single road between any two cells.
+
+        Args:
+            algorithm (str): name of the algorithm.
+        """
+        ALGORITHMS[algorithm](self)
+
+    def make_maze_dfs(self):
         """Build a maze using the Depth-First-Search algorithm."""
         # Total number of cells.
         n = self.nx * self.ny
         cell_stack = []
-        current_cell = self.cell_at(self.ix, self.iy)
+        x, y = self.ix, self.iy
+        walls = memoryview(self.walls)
         # Total number of visited cells during maze construction.
         nv = 1
 
         while nv < n:
-            neighbours = self.find_valid_neighbours(current_cell)
+            neighbours = self.unvisited_neighbours(x, y, walls)
 
             if not neighbours:
                 # We've reached a dead end: backtrack.
-                current_cell = cell_stack.pop()
+                x, y = cell_stack.pop()
                 continue
 
             # Choose a random neighbouring cell and move to it.
-            direction, next_cell = random.choice(neighbours)
-            current_cell.knock_down_wall(next_cell, direction)
-            cell_stack.append(current_cell)
-            current_cell = next_cell
+            direction, x2, y2 = random.choice(neighbours)
+            self.knock_down_wall(x, y, direction, walls)
+            cell_stack.append((x, y))
+            x, y = x2, y2
             nv += 1
 
+    def make_maze_kruskal(self):
+        """Build a maze using Kruskal's algorithm.
+
+        Walls are knocked down in random order if they separate cells that are not connected yet,
+        which are tracked with a union-find structure.
+        """
+        nx, ny = self.nx, self.ny
+        walls = memoryview(self.walls)
+        # Set of each cell, indexed by x * ny + y
+        parent = list(range(nx * ny))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        edges = [(x, y, 'E') for x in range(nx - 1) for y in range(ny)]
+        edges += [(x, y, 'S') for x in range(nx) for y in range(ny - 1)]
+        random.shuffle(edges)
+        remaining = nx * ny - 1
+        for x, y, direction in edges:
+            if not remaining:
+                break
+            dx, dy = DELTAS[direction]
+            a, b = find(x * ny + y), find((x + dx) * ny + y + dy)
+            if a != b:
+                parent[a] = b
+                self.knock_down_wall(x, y, direction, walls)
+                remaining -= 1
+
+    def make_maze_wilson(self):
+        """Build a maze using Wilson's algorithm.
+
+        Random walks start from each cell outside of the maze until they reach it, and the walk without
+        its loops is added to the maze. All spanning trees are equally likely, unlike with DFS, which
+        makes long corridors.
+        """
+        nx, ny = self.nx, self.ny
+        walls = memoryview(self.walls)
+        in_maze = [[False] * ny for _ in range(nx)]
+        in_maze[self.ix][self.iy] = True
+        # Last direction taken from each cell by the walk, later ones erase the loops
+        taken = {}
+
+        for x0 in range(nx):
+            for y0 in range(ny):
+                x, y = x0, y0
+                while not in_maze[x][y]:
+                    direction = random.choice([d for d, (dx, dy) in DELTAS.items()
+                                               if 0 <= x + dx < nx and 0 <= y + dy < ny])
+                    taken[x, y] = direction
+                    x, y = x + DELTAS[direction][0], y + DELTAS[direction][1]
+
+                x, y = x0, y0
+                while not in_maze[x][y]:
+                    in_maze[x][y] = True
+                    direction = taken[x, y]
+                    self.knock_down_wall(x, y, direction, walls)
+                    x, y = x + DELTAS[direction][0], y + DELTAS[direction][1]
+
+    def make_maze_eller(self):
+        """Build a maze using Eller's algorithm.
+
+        The maze is built row by row, keeping only the sets of connected cells of the current row, so
+        the memory used besides the walls does not grow with the number of rows. Neighbouring cells
+        of different sets are joined at random, and each set goes down to the next row at least once.
+        In the last row all the sets are joined.
+        """
+        nx, ny = self.nx, self.ny
+        walls = memoryview(self.walls)
+        sets = list(range(nx))
+        next_set = nx
+
+        for y in range(ny):
+            last = y == ny - 1
+            for x in range(nx - 1):
+                if sets[x] != sets[x + 1] and (last or random.random() < 0.5):
+                    self.knock_down_wall(x, y, 'E', walls)
+                    old = sets[x + 1]
+                    sets = [sets[x] if s == old else s for s in sets]
+            if last:
+                break
+
+            members = {}
+            for x, s in enumerate(sets):
+                members.setdefault(s, []).append(x)
+            below = []
+            for s, cells in members.items():
+                # One random cell of the set always goes down, the others half of the time
+                down = random.choice(cells)
+                for x in cells:
+                    if x == down or random.random() < 0.5:
+                        self.knock_down_wall(x, y, 'S', walls)
+                        below.append((x, s))
+            sets = list(range(next_set, next_set + nx))
+            next_set += nx
+            for x, s in below:
+                sets[x] = s
+
+    def build_wall(self, x, y, wall):
+        """Build the wall in the given direction of the cell at (x,y), on both sides."""
+
+        dx, dy = DELTAS[wall]
+        self.walls[x, y] |= WALL_BITS[wall]
+        self.walls[x + dx, y + dy] |= WALL_BITS[WALL_PAIRS[wall]]
+
+    def reachable_exits(self, start):
+        """Find the exits reachable from the start cell with a breadth-first search.
+
+        Args:
+            start (array(int)): The start cell of the road.
+
+        Returns:
+            list: The reachable end points, 1 for the bottom left corner, 2 for the top right
+            corner and 3 for the bottom right corner.
+        """
+        walls = memoryview(self.walls)
+        nx, ny = self.nx, self.ny
+        steps = [(WALL_BITS[direction], dx, dy) for direction, (dx, dy) in DELTAS.items()]
+        visited = np.zeros((nx, ny), dtype=bool)
+        seen = memoryview(visited)
+        seen[start[0], start[1]] = True
+        queue = [(start[0], start[1])]
+        for x, y in queue:
+            cell = walls[x, y]
+            for bit, dx, dy in steps:
+                # Walls are built on both sides, so the border walls keep the road inside the maze
+                if not cell & bit and not seen[x + dx, y + dy]:
+                    seen[x + dx, y + dy] = True
+                    queue.append((x + dx, y + dy))
+
+        exits = [(0, ny-1), (nx-1, 0), (nx-1, ny-1)]
+        return [i + 1 for i, (x, y) in enumerate(exits) if visited[x, y]]
+
     def check_road(self, start):
         """Check if the maze has a valid road from start to finish.
 
@@ -183,100 +474,133 @@ class Maze:
             start (array(int)): The start cell of the road.
 
         Returns:
-            int: The end point of the road, or 0 if no road is found.
+            int: The end point of the road, or 0 if none or more than one end point is reachable.
         """
-        exits = [[0, self.ny-1], [self.nx-1, 0], [self.nx-1, self.ny-1]]
-        x, y = start[0], start[1]
-        road = []
-        nor = ["N", "S", "E", "W"]
-        rotate = {'W': "S",
-                  'S': "E",
-                  'E': "N",
-                  'N': "W"}
-        antirotate = {'W': "N",
-                      'S': "W",
-                      'E': "S",
-                      'N': "E"}
-        delta = {'W': [-1, 0],
-                 'E': [1, 0],
-                 'S': [0, 1],
-                 'N': [0, -1]}
-
-        #print(self.cell_at(x, y).walls["S"])
-        #print(self.cell_at(x, y).walls["N"])
-        #print(self.cell_at(x, y).walls["W"])
-        #print(self.cell_at(x, y).walls["E"])
-        nora = 0
-        for n in nor:
-            if not self.cell_at(x, y).walls[n]:
-                nora = n
-                x += delta[nora][0]
-                y += delta[nora][1]
-                #print(f"Lenengoa {x},{y}")
+        exits = self.reachable_exits(start)
+        return exits[0] if len(exits) == 1 else 0
+
+    def close_road(self, ends=(1, 2, 3)):
+        """Close the road by adding random walls until there is only one option.
+
+        Like the first version of the dataset, walls are added on random passages, up to 4 of them, until a
+        single exit is reachable from green (0,0). The maze made by 'make_maze' is a spanning tree, so a wall
+        cuts the exits whose road from green goes through it, and the exits left are known without solving
+        the maze again. When the walls leave no exit or one that is not allowed, other walls are tried on the
+        same maze, so exits are as frequent as when the maze was created again.
+
+        Args:
+            ends (tuple(int)): The allowed end points.
+
+        Returns:
+            tuple: The maze and its end point, or 0 if no walls leave one of the allowed end points.
+        """
+        walls = memoryview(self.walls)
+        # Direction from each cell to the previous one in the road from green
+        parents = {(0, 0): None}
+        queue = [(0, 0)]
+        for x, y in queue:
+            cell = walls[x, y]
+            for direction, (dx, dy) in DELTAS.items():
+                if not cell & WALL_BITS[direction] and (x + dx, y + dy) not in parents:
+                    parents[x + dx, y + dy] = WALL_PAIRS[direction]
+                    queue.append((x + dx, y + dy))
+
+        # Cells whose wall with the previous one cuts the road to each exit
+        exits = [(0, self.ny-1), (self.nx-1, 0), (self.nx-1, self.ny-1)]
+        roads = {}
+        for end, (x, y) in enumerate(exits, 1):
+            roads[end] = set()
+            while parents[x, y] is not None:
+                roads[end].add((x, y))
+                dx, dy = DELTAS[parents[x, y]]
+                x, y = x + dx, y + dy
+
+        # An exit can be left alone if the road to every other exit can be cut without cutting its own
+        if not any(all(roads[other] - roads[end] for other in roads if other != end) for end in ends):
+            return (self, 0)
+
+        passages = [cell for cell, parent in parents.items() if parent is not None]
+        while True:
+            cut, left = [], set(roads)
+            for x, y in random.sample(passages, min(4, len(passages))):
+                cut.append((x, y))
+                left = {end for end in left if (x, y) not in roads[end]}
+                if len(left) <= 1:
+                    break
+            if len(left) == 1 and left <= set(ends):
                 break
-        i = 0
-        while [x, y] != [0, 0] and i < 100000:
-            if not self.cell_at(x, y).walls[nora]:  # if paretarik ez
-                #print(f"{x} {y} {nora}")
-                # if [x,y,nora] not in road: #if cell horretatik norazko hori hartu gabe
-                road.append([x, y, nora])
-                x += delta[nora][0]
-                y += delta[nora][1]
-                nora = rotate[nora]
-            else:
-                nora = antirotate[nora]
-            i += 1
-        # print(road)
-        results = [0, 0, 0]
-        for cell in road:
-            for i, ex in enumerate(exits):
-                if [cell[0], cell[1]] == ex:
-                    results[i] += 1
-        # print(results)
-        if results.count(0) == 2:
-            # print(results)
-            if 0 < results[0] < 3:
-                return 1
-            elif 0 < results[1] < 3:
-                return 2
-            elif 0 < results[2] < 3:
-                return 3
-        else:
-            return 0
-
-    def close_road(self):
-        """Close the road by adding a random wall so that there is only one option."""
-        end = 0
-        k = 0
-        while not end:
-            if k == 4:
-                end = 1
-                # print("oker")
-                return (self, 0)
-            rx = random.randint(0, self.nx-1)
-            ry = random.randint(0, self.ny-1)
-            cell = self.cell_at(rx, ry)
-            nora = random.choice(["N", "S", "E", "W"])
-            if not cell.walls[nora]:
-                cell.walls[nora] = True  # horma bat sortu
-                road = self.check_road([0, 0])
-                if road:  # Zuzena bada, sortu galdera... 0,0 = Beti berdetik hasi
-                    end = 1
-                    # print("Zuzen")
-                    return (self, road)
-                k += 1
-
-
-def create_image(output_path, i, nx, ny, start):
+
+        for x, y in cut:
+            self.build_wall(x, y, parents[x, y])
+        return (self, left.pop())
+
+
+# Maze generation algorithms
+ALGORITHMS = {
+    'dfs': Maze.make_maze_dfs,
+    'kruskal': Maze.make_maze_kruskal,
+    'wilson': Maze.make_maze_wilson,
+    'eller': Maze.make_maze_eller,
+}
+
+
+def draw_maze_svg(maze, filename):
+    """Rasterize the SVG image of the maze with cairosvg, without writing the SVG file.
+
+    Args:
+        maze (Maze): maze to draw.
+        filename (str): path of the PNG file.
+    """
+    # cairosvg needs the cairo library, which the fast renderer does not
+    from cairosvg import svg2png
+
+    png = svg2png(bytestring=maze.svg().encode('utf-8'))
+    save_image(Image.open(io.BytesIO(png)), filename)
+
+
+RENDERERS = {'svg': draw_maze_svg, 'fast': draw_maze_fast}
+
+
+def draw_maze(maze, filename, renderer='svg'):
+    """Draw the image of a maze, or link it from the render cache if a maze with the same walls was drawn before.
+
+    The image only depends on the walls, so they are the key of the scene.
+
+    Args:
+        maze (Maze): maze to draw.
+        filename (str): path of the image.
+        renderer (str): name of the renderer.
+    """
+    if not fetch_image(filename, scene_key('maze', renderer, maze.walls)):
+        RENDERERS[renderer](maze, filename)
+
+
+def create_image(output_path, i, nx, ny, start, renderer='svg', seed=None, algorithm='dfs', render=True):
     """Create an image of the maze.
 
+    If a seed is given, the random generator is seeded from it and the index of the maze, so each maze
+    is the same however many mazes are created before it, and in which process.
+
+    The image is drawn with 'draw_maze'. Without render, the maze is only created, to write its questions
+    and render it later.
+
     Args:
         output_path (str): path for the output images.
         i (int): index of the maze.
         nx (int): number of cells in axis x.
         ny (int): number of cells in axis y.
         start (int): start position.
+        renderer (str): name of the renderer.
+        seed (int): base random seed.
+        algorithm (str): name of the maze generation algorithm.
+        render (bool): draw the image of the maze.
+
+    Returns:
+        tuple: image filename, end position and packed walls.
     """
+    if seed is not None:
+        random.seed(f"{seed}_{i}")
+
     if start == 0:
         ix, iy = 0, 0
     elif start == 1:
@@ -286,22 +610,126 @@ def create_image(output_path, i, nx, ny, start):
     elif start == 3:
         ix, iy = nx-1, ny-1
 
-    end = start
-    while end == start:
+    # Exits are numbered like start positions, so the one of the start is not allowed
+    ends = [end for end in (1, 2, 3) if end != start]
+    end = 0
+    while not end:
         maze = Maze(nx, ny, ix, iy)
-        maze.make_maze()
-        maze, end = maze.close_road()
+        maze.make_maze(algorithm)
+        maze, end = maze.close_road(ends)
+
+    filename = image_path(f"{output_path}/maze_{i}_{nx}_{ny}_{start}_{end}.png")
+    if render:
+        draw_maze(maze, filename, renderer)
+    return os.path.basename(filename), end, maze.pack_walls()
 
-    mazename = f"{output_path}/maze_{i}_{nx}_{ny}_{start}_{end}.svg"
-    mazename_png = f"{output_path}/maze_{i}_{nx}_{ny}_{start}_{end}.png"
-    maze.write_svg(mazename)
-    svg2png(url=mazename, write_to=mazename_png)
-    os.remove(mazename)
 
+def create_image_task(args, i):
+    """Create the image of index i with the command line arguments, in a worker process.
+
+    Args:
+        args: parsed arguments.
+        i (int): index of the maze.
 
-def parse_arguments():
+    Returns:
+        tuple: image filename, end position and packed walls.
+    """
+    return create_image(args.output_path, i, args.nx, args.ny, args.start, args.renderer, args.seed,
+                        args.algorithm, not args.skip_render)
+
+
+def read_manifest_mazes(filename, output_path):
+    """Read the mazes of a manifest to render them, skipping the ones without walls.
+
+    Args:
+        filename (str): path of the manifest.
+        output_path (str): path for the output images.
+
+    Yields:
+        tuple: path of the image, number of cells in axis x and y, and packed walls.
+    """
+    skipped = 0
+    for entry in manifest_entries(filename):
+        if entry.get('walls') is None:
+            skipped += 1
+            continue
+        yield (image_path(os.path.join(output_path, entry['image'])), entry['nx'], entry['ny'],
+               entry['walls'])
+    if skipped:
+        print(f"WARNING: {skipped} mazes of the manifest have no walls and cannot be rendered!")
+
+
+def render_maze_task(renderer, task):
+    """Draw a maze of a manifest, in a worker process.
+
+    Args:
+        renderer (str): name of the renderer.
+        task (tuple): path of the image, number of cells in axis x and y, and packed walls.
+
+    Returns:
+        str: path of the image.
+    """
+    filename, nx, ny, walls = task
+    draw_maze(Maze.unpack_walls(nx, ny, walls), filename, renderer)
+    return filename
+
+
+def manifest_entry(image, nx, ny, start, end, walls):
+    """Create the manifest line of an image, with the parameters needed to create its questions.
+
+    Args:
+        image (str): image filename.
+        nx (int): number of cells in axis x.
+        ny (int): number of cells in axis y.
+        start (int): start position.
+        end (int): end position.
+        walls (str): walls packed by 'Maze.pack_walls'.
+
+    Returns:
+        str: JSON line.
+    """
+    entry = {'image': image, 'nx': nx, 'ny': ny, 'start': start, 'end': end, 'walls': walls}
+    return json.dumps(entry) + '\n'
+
+
+def map_tasks(args, writer, function, tasks):
+    """Apply a function to each task, in this process or in a pool of workers that save their own images.
+
+    Results are returned in order, so the manifest is the same for any number of workers.
+
+    Args:
+        args: parsed arguments.
+        writer (ImageWriter): image writer of this process.
+        function (callable): function that creates or draws a maze.
+        tasks (list): arguments of each call.
+
+    Yields:
+        result of each call.
+    """
+    if args.workers == 1:
+        with writer:
+            yield from tqdm(map(function, tasks), total=len(tasks), desc="Images")
+    else:
+        with Pool(args.workers, use_writer, (writer.synchronous(),)) as pool:
+            yield from tqdm(pool.imap(function, tasks, chunksize=16), total=len(tasks), desc="Images")
+
+
+def report_cache(cache):
+    """Remove the least recently used images of the render cache and print its size.
+
+    Args:
+        cache (RenderCache): render cache.
+    """
+    images, size, removed = cache.trim()
+    print(f"Render cache: {images} images ({size / 2**20:.1f} MB), {removed} least recently used removed.")
+
+
+def parse_arguments(argv=None):
     """Parse command line arguments.
 
+    Args:
+        argv (list): arguments to parse instead of the ones of the command line.
+
     Returns:
         args: parsed arguments.
     """
@@ -342,14 +770,156 @@ def parse_arguments():
         help="Path for output files.",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--algorithm",
+        type=str,
+        default='dfs',
+        choices=list(ALGORITHMS),
+        help="Maze generation algorithm. 'dfs' makes long corridors with few branches, 'wilson' makes all "
+             "mazes equally likely, 'kruskal' and 'eller' make more and shorter dead ends.",
+    )
+
+    parser.add_argument(
+        "--renderer",
+        type=str,
+        default='svg',
+        choices=['svg', 'fast'],
+        help="Renderer of the images. 'svg' rasterizes the SVG image with cairosvg. "
+             "'fast' draws the same image directly with NumPy, without cairo.",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default='manifest.jsonl',
+        help="Name of the manifest in output_path. A JSON line with the parameters of each created image is "
+             "appended to it.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to create the images.",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed. Each maze is seeded from it and its index, so the same seed creates the same "
+             "mazes for any number of workers.",
+    )
+
+    parser.add_argument(
+        "--image_format",
+        type=str,
+        default='png',
+        choices=list(IMAGE_FORMATS),
+        help="Format of the images. 'webp' is lossless.",
+    )
+
+    parser.add_argument(
+        "--compress_level",
+        type=int,
+        default=6,
+        help="Compression level of PNG images, between 0 (fastest) and 9 (smallest).",
+    )
+
+    parser.add_argument(
+        "--palette",
+        action='store_true',
+        help="Save PNG images with at most 256 colors in palette mode, smaller and faster to encode.",
+    )
+
+    parser.add_argument(
+        "--writer_threads",
+        type=int,
+        default=1,
+        help="Number of threads that save the images while the next ones are drawn. With 0, images are "
+             "saved after drawing each one. Worker processes save their own images.",
+    )
+
+    parser.add_argument(
+        "--skip_render",
+        action='store_true',
+        help="Only create the mazes and append them to the manifest, without drawing the images. Questions "
+             "can be created from the manifest, and the images drawn later with render_manifest.",
+    )
+
+    parser.add_argument(
+        "--render_manifest",
+        type=str,
+        default=None,
+        help="Draw the mazes of this manifest in output_path, like a subset of one created with skip_render, "
+             "instead of creating new mazes.",
+    )
+
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="Directory of the render cache. Mazes drawn before with the same walls, renderer and image "
+             "options are linked from it instead of drawn again.",
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=1024,
+        help="Maximum size of the render cache in MB. The least recently used images are removed at the end.",
+    )
+
+    return parser.parse_args(argv)
+
+
+def check_args(args):
+    """Check the input values, and correct them with a warning.
+
+    Args:
+        args: parsed arguments.
+
+    Returns:
+        args: corrected arguments.
+    """
+    if args.workers < 1:
+        args.workers = 1
+        print("WARNING: At least one worker is needed! Lower values have been set to 1.")
+
+    if args.writer_threads < 0:
+        args.writer_threads = 0
+        print("WARNING: The number of writer threads cannot be negative! Lower values have been set to 0.")
+
+    if not 0 <= args.compress_level <= 9:
+        args.compress_level = min(max(args.compress_level, 0), 9)
+        print("WARNING: Compression level should be between 0 and 9! It has been set to the nearest one.")
+
+    return args
 
 
 def main():
     """Main function."""
     args = parse_arguments()
-    for i in tqdm(range(args.n), total=args.n, desc="Images"):
-        create_image(args.output_path, i, args.nx, args.ny, args.start)
+    args = check_args(args)
+    if args.seed is None and args.workers > 1:
+        # Worker processes start with copies of the same random state, so they need different seeds
+        args.seed = random.randrange(2**32)
+
+    cache = RenderCache(args.cache_path, args.cache_size * 2**20) if args.cache_path else None
+    writer = ImageWriter(args.image_format, args.compress_level, args.palette, args.writer_threads, cache=cache)
+    use_writer(writer)
+    if args.render_manifest:
+        # Mazes of the manifest are only drawn, so nothing is appended to the manifest of output_path
+        mazes = list(read_manifest_mazes(args.render_manifest, args.output_path))
+        for _ in map_tasks(args, writer, partial(render_maze_task, args.renderer), mazes):
+            pass
+    else:
+        with open(os.path.join(args.output_path, args.manifest), 'a', encoding='UTF-8') as manifest:
+            images = map_tasks(args, writer, partial(create_image_task, args), range(args.n))
+            for image, end, walls in images:
+                manifest.write(manifest_entry(image, args.nx, args.ny, args.start, end, walls))
+    if cache is not None:
+        report_cache(cache)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,23 @@
 """This module creates questions for maze images."""
-import csv
+import base64
 import argparse
+import itertools
 import os
 import random
+import sys
+import numpy as np
 from tqdm import tqdm
 
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.question_files import manifest_entries, write_questions
+
+# Exit colors are saved as the number of the exit in Parquet files, like in the image filenames
+ANSWER_CODES = {'red': 1, 'blue': 2, 'yellow': 3}
+
 
 def parse_filename(filename):
     """Parse image filename to get figures matrix and lengths.
@@ -25,20 +38,138 @@ def parse_filename(filename):
     return nx, ny, start, end
 
 
-def write_questions(questions, filename):
-    """Write questions to a csv file.
+def list_images(image_path):
+    """List the images in a directory, parsing their filenames.
+
+    Args:
+        image_path (str): path to the directory with images.
+
+    Yields:
+        tuple: image filename, maze dimensions, entry and exit positions, and None because filenames
+            do not have the walls.
+    """
+    for image in os.listdir(image_path):
+        if os.path.splitext(image)[1] in ('.png', '.webp'):
+            yield (image, *parse_filename(image), None)
+
+
+def read_manifest(filename):
+    """Read the images of a manifest created by create_images.py, one line at a time.
+
+    Args:
+        filename (str): path to the manifest.
+
+    Yields:
+        tuple: image filename, maze dimensions, entry and exit positions, and packed walls (None in
+            manifests created by older versions).
+    """
+    for entry in manifest_entries(filename):
+        yield (entry['image'], entry['nx'], entry['ny'], entry['start'], entry['end'],
+               entry.get('walls'))
+
+
+def unpack_walls(walls, nx, ny):
+    """Unpack the walls saved by 'Maze.pack_walls' in create_images.py.
+
+    Args:
+        walls (str): base64 string of the South and East wall bits.
+        nx (int): number of cells in axis x.
+        ny (int): number of cells in axis y.
+
+    Returns:
+        numpy.ndarray: [2, nx, ny] South and East walls.
+    """
+    bits = np.unpackbits(np.frombuffer(base64.b64decode(walls), dtype=np.uint8), count=2 * nx * ny)
+    return bits.reshape(2, nx, ny).astype(bool)
+
+
+def solve_mazes(walls, ends):
+    """Solve mazes of the same size with a breadth-first search from green (0,0), all at once.
+
+    Args:
+        walls (numpy.ndarray): [mazes, 2, nx, ny] South and East walls of each maze.
+        ends (numpy.ndarray): end position of each maze, 1 for the bottom left corner, 2 for the top right
+            corner and 3 for the bottom right corner.
+
+    Returns:
+        dict: 'length' (moves from green to the exit), 'dead_ends' (cells with a single opening) and 'turns'
+            (changes of direction from green to the exit) of each maze.
+    """
+    n, _, nx, ny = walls.shape
+    south, east = ~walls[:, 0, :, :-1], ~walls[:, 1, :-1, :]
+
+    # Open passages from each cell, in the directions of 'steps'
+    openings = np.zeros((4, n, nx, ny), dtype=bool)
+    openings[0, :, :, 1:] = south
+    openings[1, :, :, :-1] = south
+    openings[2, :, 1:, :] = east
+    openings[3, :, :-1, :] = east
+    steps = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+
+    # Number of moves from green to each cell, -1 if it is not reachable
+    distance = np.full((n, nx, ny), -1)
+    distance[:, 0, 0] = 0
+    frontier = distance == 0
+    moves = 0
+    while frontier.any():
+        moves += 1
+        reached = np.zeros_like(frontier)
+        reached[:, :, 1:] |= frontier[:, :, :-1] & south
+        reached[:, :, :-1] |= frontier[:, :, 1:] & south
+        reached[:, 1:, :] |= frontier[:, :-1, :] & east
+        reached[:, :-1, :] |= frontier[:, 1:, :] & east
+        frontier = reached & (distance < 0)
+        distance[frontier] = moves
+
+    mazes = np.arange(n)
+    x = np.where(ends == 1, 0, nx - 1)
+    y = np.where(ends == 2, 0, ny - 1)
+    length = distance[mazes, x, y]
+
+    # Go back from the exit to green, counting the changes of direction
+    turns = np.zeros(n, dtype=int)
+    previous = np.full(n, -1)
+    for moves in range(length.max(), 0, -1):
+        active = length >= moves
+        step = np.zeros(n, dtype=int)
+        for i, (dx, dy) in enumerate(steps):
+            # Cells outside the maze have no openings, so indices are clipped to stay inside
+            back = openings[i, mazes, x, y] & (
+                distance[mazes, np.clip(x + dx, 0, nx - 1), np.clip(y + dy, 0, ny - 1)] == moves - 1)
+            step[back] = i
+        turns += active & (previous >= 0) & (step != previous)
+        previous = np.where(active, step, previous)
+        x = np.where(active, x + np.array(steps)[step, 0], x)
+        y = np.where(active, y + np.array(steps)[step, 1], y)
+
+    dead_ends = openings.sum(axis=0) == 1
+    return {'length': length, 'dead_ends': dead_ends.sum(axis=(1, 2)), 'turns': turns}
+
+
+def solve_chunk(chunk):
+    """Solve the mazes of a chunk that have walls, grouped by size so that each group is solved at once.
 
     Args:
-        questions (list): list of questions.
-        filename (str): path to the output file.
+        chunk (list): image tuples, as returned by 'read_manifest'.
+
+    Returns:
+        list: dictionary with the answers of each maze, as returned by 'solve_mazes', or None for mazes
+            without walls.
     """
-    with open(filename, 'w', encoding='UTF-8', newline="") as csvfile:
-        spamwriter = csv.writer(csvfile, delimiter=',',
-                                quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        spamwriter.writerow(['type', 'question', 'correct',
-                             'wrong1', 'wrong2', 'image'])
-        for question in questions:
-            spamwriter.writerow(question)
+    groups = {}
+    for i, (_, nx, ny, _, _, walls) in enumerate(chunk):
+        if walls is not None:
+            groups.setdefault((nx, ny), []).append(i)
+
+    solutions = [None] * len(chunk)
+    for (nx, ny), indices in groups.items():
+        walls = np.stack([unpack_walls(chunk[i][5], nx, ny) for i in indices])
+        ends = np.array([chunk[i][4] for i in indices])
+        group_solutions = solve_mazes(walls, ends)
+        for j, i in enumerate(indices):
+            solutions[i] = {key: int(value[j]) for key, value in group_solutions.items()}
+
+    return solutions
 
 
 def wrong_answers(correct):
@@ -61,51 +192,97 @@ def wrong_answers(correct):
     return answers[1], answers[2]
 
 
-def create_questions(image_path):
+def maze_questions(image, nx, ny, end, solution):
+    """Create the questions of a maze.
+
+    Args:
+        image (str): image filename.
+        nx (int): number of cells in axis x.
+        ny (int): number of cells in axis y.
+        end (int): exit position.
+        solution (dict): answers computed from the walls, as returned by 'solve_chunk', or None.
+
+    Yields:
+        list: question, answers and image filename.
+    """
+    category = "Maze"
+
+    question = "How many cells?"
+    correct = nx * ny
+    wrong1, wrong2 = wrong_answers(correct)
+    yield [category, question, correct,
+           wrong1, wrong2, image]
+
+    question = "How many colums?"
+    correct = nx
+    wrong1, wrong2 = wrong_answers(correct)
+    yield [category, question, correct,
+           wrong1, wrong2, image]
+
+    question = "How many rows?"
+    correct = ny
+    wrong1, wrong2 = wrong_answers(correct)
+    yield [category, question, correct,
+           wrong1, wrong2, image]
+
+    question = "Which is the exit starting from green?"
+    if end == 1:
+        correct, wrong1, wrong2 = "red", "yellow", "blue"
+    elif end == 2:
+        correct, wrong1, wrong2 = "blue", "red", "yellow"
+    elif end == 3:
+        correct, wrong1, wrong2 = "yellow", "red", "blue"
+    yield [category, question, correct,
+           wrong1, wrong2, image]
+
+    if solution is None:
+        return
+
+    question = "How many moves from green to the exit?"
+    correct = solution['length']
+    wrong1, wrong2 = wrong_answers(correct)
+    yield [category, question, correct,
+           wrong1, wrong2, image]
+
+    question = "How many dead ends?"
+    correct = solution['dead_ends']
+    wrong1, wrong2 = wrong_answers(correct)
+    yield [category, question, correct,
+           wrong1, wrong2, image]
+
+    question = "How many turns from green to the exit?"
+    correct = solution['turns']
+    wrong1, wrong2 = wrong_answers(correct)
+    yield [category, question, correct,
+           wrong1, wrong2, image]
+
+
+def create_questions(image_path, manifest=None, chunk_size=10000):
     """Create questions for each image in the images_path directory.
 
+    Mazes with walls in the manifest are solved in chunks of chunk_size images, to create questions
+    about their paths.
+
     Args:
         image_path (str): path to the directory with images.
+        manifest (str): path to the manifest created by create_images.py. If not given,
+            images are parsed from the filenames in image_path.
+        chunk_size (int): number of mazes solved at once.
 
-    Returns:
-        list: list of questions.
+    Yields:
+        list: question, answers and image filename.
     """
-    category = "Maze"
-    images = os.listdir(image_path)
-    questions = []
-
-    for image in tqdm(images, desc='Questions', total=len(images)):
-        nx, ny, start, end = parse_filename(image)
-
-        question = "How many cells?"
-        correct = nx * ny
-        wrong1, wrong2 = wrong_answers(correct)
-        questions.append([category, question, correct,
-                          wrong1, wrong2, image])
-
-        question = "How many colums?"
-        correct = nx
-        wrong1, wrong2 = wrong_answers(correct)
-        questions.append([category, question, correct,
-                          wrong1, wrong2, image])
-
-        question = "How many rows?"
-        correct = ny
-        wrong1, wrong2 = wrong_answers(correct)
-        questions.append([category, question, correct,
-                          wrong1, wrong2, image])
-
-        question = "Which is the exit starting from green?"
-        if end == 1:
-            correct, wrong1, wrong2 = "red", "yellow", "blue"
-        elif end == 2:
-            correct, wrong1, wrong2 = "blue", "red", "yellow"
-        elif end == 3:
-            correct, wrong1, wrong2 = "yellow", "red", "blue"
-        questions.append([category, question, correct,
-                          wrong1, wrong2, image])
-
-    return questions
+    images = read_manifest(manifest) if manifest else list_images(image_path)
+
+    with tqdm(desc='Questions') as progress:
+        while True:
+            chunk = list(itertools.islice(images, chunk_size))
+            if not chunk:
+                break
+
+            for (image, nx, ny, _, end, _), solution in zip(chunk, solve_chunk(chunk)):
+                yield from maze_questions(image, nx, ny, end, solution)
+            progress.update(len(chunk))
 
 
 def parse_arguments():
@@ -123,11 +300,27 @@ def parse_arguments():
         help="Path for input images.",
     )
 
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="Manifest created by create_images.py. If not given, images are parsed from the filenames in "
+             "image_path.",
+    )
+
     parser.add_argument(
         "--filename",
         type=str,
         default='questions.csv',
-        help="Path for output file.",
+        help="Path for output file. Compressed with gzip if it ends with .gz.",
+    )
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        default='csv',
+        choices=['csv', 'parquet'],
+        help="Format of the output file. 'parquet' needs pyarrow.",
     )
 
     return parser.parse_args()
@@ -136,8 +329,8 @@ def parse_arguments():
 def main():
     """Main function."""
     args = parse_arguments()
-    questions = create_questions(args.image_path)
-    write_questions(questions, args.filename)
+    questions = create_questions(args.image_path, args.manifest)
+    write_questions(questions, args.filename, args.format, ANSWER_CODES)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+"""This module creates mazes and their questions when they are used, as a dataset that does not use the disk."""
+import os
+import sys
+
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.datasets import kept_random_state, to_rgb
+from common.image_writer import capture_images
+from create_images import RENDERERS, Maze, create_image
+from create_questions import maze_questions, solve_chunk
+
+
+class MazeDataset:
+    """Questions of n random mazes, drawn in memory when they are used.
+
+    Maze i is created from the seed and i, like 'create_image' does with a seed, so every item is the same
+    in any process, and the dataset can be read by several workers, like the ones of a PyTorch DataLoader.
+    Each item is an (image, question, correct, wrong1, wrong2) tuple, where image is a [400, width, 3] uint8
+    array, with width int(400 * nx / ny), 600 for the default size. Mazes are drawn on a transparent
+    background, and images are converted to RGB like 'evaluate.py' does, which makes it black like the
+    walls. With white_background, it is made white instead. Questions of a maze are consecutive
+    items, and the last maze is kept, so each maze is drawn only once when items are read in order.
+
+    """
+
+    # Cells, columns, rows, exit, moves, dead ends and turns
+    questions_per_maze = 7
+
+    def __init__(self, n, nx=12, ny=8, start=0, algorithm='dfs', renderer='fast', seed=0,
+                 white_background=False):
+        """Create the dataset. No maze is created until it is used.
+
+        Args:
+            n (int): number of mazes.
+            nx (int): number of cells in axis x.
+            ny (int): number of cells in axis y.
+            start (int): start position.
+            algorithm (str): name of the maze generation algorithm.
+            renderer (str): name of the renderer. 'fast' does not need cairo.
+            seed (int): random seed of the dataset.
+            white_background (bool): draw the mazes over a white background instead of a black one.
+        """
+        self.n = n
+        self.nx, self.ny = nx, ny
+        self.start = start
+        self.algorithm = algorithm
+        self.renderer = renderer
+        self.seed = seed
+        self.white_background = white_background
+        self.last = None
+
+    def __len__(self):
+        return self.n * self.questions_per_maze
+
+    def maze(self, i):
+        """Create maze i, draw it and create its questions.
+
+        Args:
+            i (int): index of the maze.
+
+        Returns:
+            tuple: [400, width, 3] image array and list of (question, correct, wrong1, wrong2) tuples.
+        """
+        if self.last is not None and self.last[0] == i:
+            return self.last[1]
+
+        with kept_random_state():
+            name, end, walls = create_image('', i, self.nx, self.ny, self.start, self.renderer, self.seed,
+                                            self.algorithm, render=False)
+            with capture_images() as images:
+                RENDERERS[self.renderer](Maze.unpack_walls(self.nx, self.ny, walls), name)
+            image = to_rgb(images[name], self.white_background)
+
+            maze = (name, self.nx, self.ny, self.start, end, walls)
+            solution = solve_chunk([maze])[0]
+            questions = [tuple(question[1:5])
+                         for question in maze_questions(name, self.nx, self.ny, end, solution)]
+        self.last = (i, (image, questions))
+        return image, questions
+
+    def __getitem__(self, index):
+        """Get a question of a maze, drawing the maze if it is not the last one.
+
+        Args:
+            index (int): index of the question. Questions of maze i start at i * questions_per_maze.
+
+        Returns:
+            tuple: image, question, correct, wrong1 and wrong2.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Question index out of range")
+
+        i, question = divmod(index, self.questions_per_maze)
+        image, questions = self.maze(i)
+        return (image, *questions[question])
+
+    def __iter__(self):
+        """Draw each maze once and yield its questions."""
+
+        for i in range(self.n):
+            image, questions = self.maze(i)
+            for question in questions:
+                yield (image, *question)
@@ -0,0 +1,292 @@
+"""This module draws maze images directly into NumPy arrays, without writing and parsing SVG files.
+
+Images are the same as the ones rasterized by cairosvg from 'Maze.svg'. Walls are axis aligned
+rectangles, so their coverage is computed exactly and they are composited one by one with the 8-bit
+arithmetic of cairo. Exit circles are flattened and sampled like cairo does, up to a few levels of
+antialiasing on their border, and they are computed only once because every maze has the same ones.
+"""
+import functools
+import math
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+# Modules shared by every task are in the common package of the data directory
+DATA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from common.image_writer import save_image
+
+# Walls are drawn with square caps, so they are rectangles that extend half the width around each line
+WALL_WIDTH = 5
+
+# Exit circles of 'Maze.svg': center, radius, stroke width and fill color
+CIRCLES = [
+    ((25, 25), 15, 3, (0, 128, 0)),
+    ((575, 25), 15, 3, (0, 0, 255)),
+    ((25, 375), 15, 3, (255, 0, 0)),
+    ((575, 375), 15, 3, (255, 255, 0)),
+]
+
+# Cairo flattens curves up to this distance in pixels, and samples this many rows per pixel
+TOLERANCE = 0.1
+SAMPLE_ROWS = 15
+
+
+def div_255(values):
+    """Divide integers by 255, rounding to the nearest like cairo and pixman do.
+
+    Args:
+        values (numpy.ndarray): integer array.
+
+    Returns:
+        numpy.ndarray: rounded quotients.
+    """
+    return (2 * values + 255) // 510
+
+
+def to_alpha(coverage):
+    """Convert coverage fractions to 8-bit alpha values.
+
+    Args:
+        coverage (numpy.ndarray): fraction of each pixel covered by a shape.
+
+    Returns:
+        numpy.ndarray: alpha values between 0 and 255.
+    """
+    return np.floor(coverage * 255 + 0.5).astype(np.int32)
+
+
+def interval_coverage(start, end, first, last):
+    """Return the fraction of each pixel from first to last (not included) covered by [start, end].
+
+    Args:
+        start (float): start of the interval.
+        end (float): end of the interval.
+        first (int): first pixel.
+        last (int): last pixel, not included.
+
+    Returns:
+        numpy.ndarray: coverage of each pixel.
+    """
+    pixels = np.arange(first, last)
+    return np.clip(np.minimum(end, pixels + 1) - np.maximum(start, pixels), 0, 1)
+
+
+@functools.lru_cache(maxsize=None)
+def wall_mask(left, top, right, bottom):
+    """Compute the alpha values of a wall rectangle, relative to the pixel of its top left corner.
+
+    Walls of a maze are in a regular grid, so the same few masks are used for all of them.
+
+    Args:
+        left (float): left side, between 0 and 1.
+        top (float): top side, between 0 and 1.
+        right (float): right side.
+        bottom (float): bottom side.
+
+    Returns:
+        numpy.ndarray: alpha values.
+    """
+    coverage = np.outer(interval_coverage(top, bottom, 0, math.ceil(bottom)),
+                        interval_coverage(left, right, 0, math.ceil(right)))
+    return to_alpha(coverage)
+
+
+def draw_walls(alpha, lines):
+    """Composite the walls over the alpha channel of the image.
+
+    Args:
+        alpha (numpy.ndarray): [height, width] alpha channel, modified in place.
+        lines (list): (x1, y1, x2, y2) lines of the walls, as returned by 'Maze.wall_lines'.
+    """
+    height, width = alpha.shape
+    half = WALL_WIDTH / 2
+    for x1, y1, x2, y2 in lines:
+        left, right = min(x1, x2) - half, max(x1, x2) + half
+        top, bottom = min(y1, y2) - half, max(y1, y2) + half
+        col, row = math.floor(left), math.floor(top)
+        mask = wall_mask(left - col, top - row, right - col, bottom - row)
+
+        # Walls on the border are partly outside of the image
+        rows = slice(max(row, 0), min(row + mask.shape[0], height))
+        cols = slice(max(col, 0), min(col + mask.shape[1], width))
+        mask = mask[rows.start - row:rows.stop - row, cols.start - col:cols.stop - col]
+        region = alpha[rows, cols]
+        region += div_255(mask * (255 - region))
+
+
+def flatten_circle(center, radius):
+    """Flatten a circle into a polygon, like cairo does with the four Bezier curves of an arc.
+
+    Args:
+        center (tuple): (x, y) center of the circle.
+        radius (float): radius of the circle.
+
+    Returns:
+        list: (x, y) vertices of the polygon.
+    """
+    cx, cy = center
+
+    def error(p0, p1, p2, p3):
+        # Largest distance from the control points to the segment between the end points
+        distances = []
+        dx, dy = p3[0] - p0[0], p3[1] - p0[1]
+        length = dx * dx + dy * dy
+        for px, py in (p1, p2):
+            px, py = px - p0[0], py - p0[1]
+            dot = px * dx + py * dy
+            if length == 0 or dot <= 0:
+                distances.append(px * px + py * py)
+            elif dot >= length:
+                distances.append((px - dx) ** 2 + (py - dy) ** 2)
+            else:
+                distances.append((px * dy - py * dx) ** 2 / length)
+        return max(distances)
+
+    def middle(p, q):
+        return (p[0] + q[0]) / 2, (p[1] + q[1]) / 2
+
+    def decompose(p0, p1, p2, p3, vertices):
+        if error(p0, p1, p2, p3) < TOLERANCE ** 2:
+            vertices.append(p3)
+            return
+        p01, p12, p23 = middle(p0, p1), middle(p1, p2), middle(p2, p3)
+        p012, p123 = middle(p01, p12), middle(p12, p23)
+        p0123 = middle(p012, p123)
+        decompose(p0, p01, p012, p0123, vertices)
+        decompose(p0123, p123, p23, p3, vertices)
+
+    vertices = [(cx + radius, cy)]
+    h = 4 / 3 * math.tan(math.pi / 8) * radius
+    for i in range(4):
+        a0, a1 = i * math.pi / 2, (i + 1) * math.pi / 2
+        p0 = (cx + radius * math.cos(a0), cy + radius * math.sin(a0))
+        p3 = (cx + radius * math.cos(a1), cy + radius * math.sin(a1))
+        p1 = (p0[0] - h * math.sin(a0), p0[1] + h * math.cos(a0))
+        p2 = (p3[0] + h * math.sin(a1), p3[1] - h * math.cos(a1))
+        decompose(p0, p1, p2, p3, vertices)
+    return vertices[:-1]
+
+
+def polygon_coverage(polygons, box):
+    """Return the fraction of each pixel in box covered by polygons, with the even-odd rule.
+
+    Coverage is sampled in SAMPLE_ROWS rows per pixel and computed exactly along each row.
+
+    Args:
+        polygons (list): polygons as lists of (x, y) vertices.
+        box (tuple): (left, top, right, bottom) pixels.
+
+    Returns:
+        numpy.ndarray: [bottom - top, right - left] coverage.
+    """
+    left, top, right, bottom = box
+    edges = np.array([(*polygon[i - 1], *polygon[i]) for polygon in polygons for i in range(len(polygon))])
+    x0, y0, x1, y1 = edges.T
+
+    rows = top + (np.arange((bottom - top) * SAMPLE_ROWS) + 0.5) / SAMPLE_ROWS
+    y = rows[:, np.newaxis]
+    crossed = (y0 <= y) & (y < y1) | (y1 <= y) & (y < y0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossings = np.where(crossed, x0 + (y - y0) * (x1 - x0) / (y1 - y0), np.inf)
+    crossings = np.sort(crossings, axis=1)
+
+    pixels = np.arange(left, right)
+    coverage = np.zeros((len(rows), right - left))
+    for i in range(0, crossings.shape[1] - 1, 2):
+        start, end = crossings[:, i, np.newaxis], crossings[:, i + 1, np.newaxis]
+        coverage += np.clip(np.minimum(end, pixels + 1) - np.maximum(start, pixels), 0, 1)
+    return coverage.reshape(bottom - top, SAMPLE_ROWS, right - left).mean(axis=1)
+
+
+@functools.lru_cache(maxsize=None)
+def circle_masks():
+    """Compute the fill and stroke alpha values of the exit circles.
+
+    Returns:
+        list: (box, fill alpha, stroke alpha, fill color) tuples.
+    """
+    masks = []
+    for center, radius, stroke_width, color in CIRCLES:
+        extent = math.ceil(radius + stroke_width)
+        box = (center[0] - extent, center[1] - extent, center[0] + extent, center[1] + extent)
+
+        vertices = flatten_circle(center, radius)
+        fill = polygon_coverage([vertices], box)
+        # The stroke is the ring between the polygon moved half the stroke width out and in
+        stroke = []
+        for offset in (stroke_width / 2, -stroke_width / 2):
+            scale = (radius + offset) / radius
+            stroke.append([(center[0] + (x - center[0]) * scale, center[1] + (y - center[1]) * scale)
+                           for x, y in vertices])
+        stroke = polygon_coverage(stroke, box)
+
+        masks.append((box, to_alpha(fill), to_alpha(stroke), np.array(color)))
+    return masks
+
+
+def draw_circles(pixels, alpha):
+    """Composite the exit circles over the image, filled and then stroked in black.
+
+    Walls are black, so colors are only set inside the boxes of the circles.
+
+    Args:
+        pixels (numpy.ndarray): [height, width, 4] RGBA image, whose colors are set in place.
+        alpha (numpy.ndarray): [height, width] alpha channel, modified in place.
+    """
+    height, width = alpha.shape
+    for (left, top, right, bottom), fill, stroke, color in circle_masks():
+        # Circles are at the same positions for every size, so they can be partly or fully outside
+        rows = slice(max(top, 0), min(bottom, height))
+        cols = slice(max(left, 0), min(right, width))
+        if rows.start >= rows.stop or cols.start >= cols.stop:
+            continue
+        mask_rows = slice(rows.start - top, rows.stop - top)
+        mask_cols = slice(cols.start - left, cols.stop - left)
+        fill = fill[mask_rows, mask_cols, np.newaxis]
+        stroke = stroke[mask_rows, mask_cols, np.newaxis]
+
+        # Colors premultiplied by alpha, like cairo stores them
+        region_alpha = alpha[rows, cols, np.newaxis]
+        rgb = div_255(color * fill)
+        region_alpha += div_255(fill * (255 - region_alpha))
+        rgb = div_255(rgb * (255 - stroke))
+        region_alpha += div_255(stroke * (255 - region_alpha))
+
+        # PNG colors are not premultiplied
+        visible = region_alpha > 0
+        rgb = np.where(visible, (rgb * 255 + region_alpha // 2) // np.maximum(region_alpha, 1), 0)
+        pixels[rows, cols, :3] = rgb
+
+
+def render_maze(maze):
+    """Draw the maze image, with transparent background like cairosvg.
+
+    Args:
+        maze (Maze): maze to draw.
+
+    Returns:
+        Image: RGBA image.
+    """
+    width, height = maze.image_size()
+    alpha = np.zeros((height, width), dtype=np.int32)
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+
+    draw_walls(alpha, maze.wall_lines())
+    draw_circles(pixels, alpha)
+    pixels[..., 3] = alpha
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def draw_maze_fast(maze, filename):
+    """Draw the maze image and save it as a PNG file.
+
+    Args:
+        maze (Maze): maze to draw.
+        filename (str): path of the PNG file.
+    """
+    save_image(render_maze(maze), filename)
@@ -0,0 +1,40 @@
+"""Tests that the wall added by 'Maze.close_road' leaves a single exit, and that every allowed exit is chosen."""
+import pytest
+
+from create_images import ALGORITHMS, Maze, create_image
+
+
+def created_exits(nx, ny, start, algorithm, n=300):
+    """Create mazes without drawing them, and check that their exit is the only one reachable from green.
+
+    Args:
+        nx (int): number of cells in axis x.
+        ny (int): number of cells in axis y.
+        start (int): start position.
+        algorithm (str): name of the maze generation algorithm.
+        n (int): number of mazes.
+
+    Returns:
+        set: exits of the mazes.
+    """
+    exits = set()
+    for i in range(n):
+        _, end, walls = create_image('', i, nx, ny, start, seed=0, algorithm=algorithm, render=False)
+        assert Maze.unpack_walls(nx, ny, walls).reachable_exits([0, 0]) == [end], (i, end)
+        exits.add(end)
+    return exits
+
+
+@pytest.mark.parametrize('algorithm', list(ALGORITHMS))
+@pytest.mark.parametrize('nx, ny', [(12, 8), (5, 5), (8, 12)])
+def test_every_exit(nx, ny, algorithm):
+    """Every exit, including the yellow one, is the only reachable exit of some mazes."""
+
+    assert created_exits(nx, ny, 0, algorithm) == {1, 2, 3}
+
+
+@pytest.mark.parametrize('start', [1, 2, 3])
+def test_start_exit(start):
+    """The exit of the start position is never chosen, and the other two are."""
+
+    assert created_exits(12, 8, start, 'dfs') == {1, 2, 3} - {start}